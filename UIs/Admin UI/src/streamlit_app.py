@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import os
 
 API_URL = os.getenv("API_BASE")
@@ -28,18 +29,38 @@ with st.sidebar:
 # Input area
 question = st.text_input("Enter your question below:")
 
+def stream_answer(question: str):
+    # Yields (event, data) pairs from the /ask/stream server-sent events.
+    with requests.post(f"{API_URL}/ask/stream", json={"query": question}, stream=True, timeout=120) as res:
+        res.raise_for_status()
+        event = "message"
+        for line in res.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
+
 if st.button("Submit Question") and question.strip():
-    with st.spinner("Getting an answer..."):
-        try:
-            # Pass query as a query parameter
-            res = requests.post(f"{API_URL}/ask?query={question}")
-            if res.status_code == 200:
-                answer = res.json()["response"]
-                st.success("Answer:")
-                st.write(answer)
-                # Add to session history
-                st.session_state.qa_history.append({"question": question, "answer": answer})
-            else:
-                st.error(f"Error, Please check logs.")
-        except Exception as e:
-            st.error("Failed to connect to the backend. Please check the logs and try again.")
\ No newline at end of file
+    st.success("Answer:")
+    placeholder = st.empty()
+    answer = ""
+    try:
+        with st.spinner("Getting an answer..."):
+            for event, data in stream_answer(question):
+                if event == "token":
+                    answer += data["content"]
+                    placeholder.markdown(answer + "▌")
+                elif event == "answer":
+                    answer = data["response"]
+                elif event == "error":
+                    raise RuntimeError(data.get("detail", "Unknown error"))
+        placeholder.markdown(answer)
+        # Add to session history
+        st.session_state.qa_history.append({"question": question, "answer": answer})
+    except requests.exceptions.ConnectionError:
+        st.error("Failed to connect to the backend. Please check the logs and try again.")
+    except Exception as e:
+        st.error(f"Error, Please check logs.")
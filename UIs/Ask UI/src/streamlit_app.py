@@ -7,6 +7,7 @@ import streamlit as st
 import requests
 import base64
 import datetime
+import time
 
 API_URL = os.getenv("API_BASE")
 
@@ -38,10 +39,31 @@ if uploaded_file is not None:
                 )
                 
                 st.success(res.json()["message"])
+                st.session_state.upload_job_id = res.json().get("job_id")
                 
             except Exception as e:
                 st.error("Upload failed. Check logs.")
 
+# Ingestion runs in the background; follow the job until it finishes.
+if st.session_state.get("upload_job_id"):
+    status_box = st.empty()
+    try:
+        while True:
+            job = requests.get(f"{API_URL}/jobs/{st.session_state.upload_job_id}").json()
+            if job["status"] == "completed":
+                status_box.success(f"{job['file_name']}.pdf processed successfully.")
+                st.session_state.upload_job_id = None
+                break
+            if job["status"] == "failed":
+                status_box.error(f"Processing {job['file_name']}.pdf failed: {job.get('error')}")
+                st.session_state.upload_job_id = None
+                break
+            status_box.info(f"Processing {job['file_name']}.pdf: {job['status']}...")
+            time.sleep(1)
+    except Exception as e:
+        status_box.error("Failed to fetch processing status. Check logs.")
+        st.session_state.upload_job_id = None
+
 
 # Delete file
 if file_list:
@@ -104,50 +126,71 @@ with st.expander("⚙️ Config Editor (click to expand)"):
 
 
 # --- LOG VIEWER ---
+def format_log_records(records):
+    return "\n".join(
+        f"{r.get('time') or ''} - {r.get('level') or ''} - [{r.get('request_id') or '-'}] {r.get('message', '')}"
+        for r in records
+    )
+
+
+def fetch_logs(offset):
+    params = {"offset": offset, "limit": st.session_state.log_page_size}
+    if st.session_state.log_level != "ALL":
+        params["level"] = st.session_state.log_level
+    if st.session_state.log_request_id:
+        params["request_id"] = st.session_state.log_request_id
+    res = requests.get(f"{API_URL}/logs", params=params)
+    res.raise_for_status()
+    page = res.json()
+    st.session_state.log_offset = offset
+    st.session_state.log_next_offset = page["next_offset"]
+    st.session_state.logs = format_log_records(page["logs"])
+
+
 with st.expander("📜 View Logs (click to expand)"):
-    col1, col2 = st.columns([3, 1])
-    
+    st.session_state.setdefault("log_offset", 0)
+    st.session_state.setdefault("log_next_offset", None)
+
+    filter_col1, filter_col2, filter_col3 = st.columns([1, 1, 2])
+    with filter_col1:
+        st.selectbox("Minimum level", ["ALL", "DEBUG", "PROCESS", "INFO", "SUCCESS", "ERROR"], key="log_level")
+    with filter_col2:
+        st.selectbox("Records per page", [50, 200, 1000], index=1, key="log_page_size")
+    with filter_col3:
+        st.text_input("Request ID", key="log_request_id")
+
+    col1, col2, col3 = st.columns([2, 1, 1])
+
     with col1:
-        if st.button("Load Logs"):
+        if st.button("Load Latest Logs"):
             with st.spinner("Fetching logs..."):
                 try:
-                    res = requests.get(f"{API_URL}/logs")
-                    log_content = res.json()["logs"]
-                    st.session_state.logs = log_content
-                    st.text_area("Logs", log_content, height=400)
-                    
+                    fetch_logs(0)
                 except Exception as e:
                     st.error("Error fetching logs. Check logs.")
                     st.session_state.logs = None
-    
-    # Download logs button
+
+    # Newest records come first; "Older" walks back through the log and its rotated files.
     with col2:
-        if st.button("Download Logs"):
-            if 'logs' in st.session_state and st.session_state.logs:
-                log_content = st.session_state.logs
-                
-                # Create timestamp for filename
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"logs_{timestamp}.txt"
-                
-                # Create download link
-                b64 = base64.b64encode(log_content.encode()).decode()
-                href = f'<a href="data:file/txt;base64,{b64}" download="{filename}">Download log file</a>'
-                st.markdown(href, unsafe_allow_html=True)
-            else:
-                with st.spinner("Fetching logs for download..."):
-                    try:
-                        res = requests.get(f"{API_URL}/logs")
-                        log_content = res.json()["logs"]
-                        
-                        # Create timestamp for filename
-                        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"logs_{timestamp}.txt"
-                        
-                        # Create download link
-                        b64 = base64.b64encode(log_content.encode()).decode()
-                        href = f'<a href="data:file/txt;base64,{b64}" download="{filename}">Download log file</a>'
-                        st.markdown(href, unsafe_allow_html=True)
-                        
-                    except Exception as e:
-                        st.error("Error downloading logs. Check logs.")
\ No newline at end of file
+        if st.button("Newer", disabled=st.session_state.log_offset == 0):
+            try:
+                fetch_logs(max(st.session_state.log_offset - st.session_state.log_page_size, 0))
+            except Exception as e:
+                st.error("Error fetching logs. Check logs.")
+
+    with col3:
+        if st.button("Older", disabled=st.session_state.log_next_offset is None):
+            try:
+                fetch_logs(st.session_state.log_next_offset)
+            except Exception as e:
+                st.error("Error fetching logs. Check logs.")
+
+    if st.session_state.get("logs") is not None:
+        st.text_area("Logs (newest first)", st.session_state.logs, height=400)
+
+        # Download the records currently shown
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"logs_{timestamp}.txt"
+        b64 = base64.b64encode(st.session_state.logs.encode()).decode()
+        href = f'<a href="data:file/txt;base64,{b64}" download="{filename}">Download these logs</a>'
+        st.markdown(href, unsafe_allow_html=True)
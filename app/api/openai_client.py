@@ -1,48 +1,66 @@
-from openai import OpenAI
-from typing import List, Dict, Optional
+import httpx
+import asyncio
+from openai import OpenAI, AsyncOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 
 from utils.config_handler import ConfigHandler
-from utils.logger import log_event
-from app.config import OPENAI_API_KEY
+from utils.token_handler import TokenHandler
+from utils.embedding_cache import embedding_cache
+from utils.logger import log_event, log_enabled
+from utils.metrics import openai_request_seconds, record_usage
+from app.config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+# One pooled client shared by every in-flight async request on the event loop.
+async_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    ),
+)
+token_handler = TokenHandler()
+
+
+def _chat_request(system_prompt: str, user_query: str, temp: float, max_tokens=None, chat_history: List[Dict] = None) -> Dict:
+    if chat_history is None:
+        chat_history = []
+
+    if log_enabled("DEBUG"):
+        log_event("DEBUG", f"User Query: {user_query}\n\nPrompt:\n\n{system_prompt}\n\nChat History Length: {len(chat_history)}")
+
+    # Build messages array starting with system prompt
+    messages = [{"role": "system", "content": system_prompt}]
+
+    # Add chat history if provided
+    if chat_history:
+        messages.extend(chat_history)
+
+    # Add the current user query
+    messages.append({"role": "user", "content": user_query})
+
+    config = ConfigHandler().load_config()
+    CHAT_MODEL = config.get("chat_model_name")
+    log_event("PROCESS", f"Sending message to OpenAI GPT with {len(messages)} total messages.")
+
+    request = {"model": CHAT_MODEL, "messages": messages, "temperature": temp}
+    if max_tokens:
+        request["max_tokens"] = max_tokens
+    return request
 
 
 def chat_with_gpt(system_prompt: str, user_query: str, temp: float, max_tokens=None, chat_history: List[Dict] = None) -> str:
     try:
-        if chat_history is None:
-            chat_history = []
-            
-        log_event("PROCESS", f"User Query: {user_query}\n\nPrompt:\n\n{system_prompt}\n\nChat History Length: {len(chat_history)}")
-        
-        # Build messages array starting with system prompt
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add chat history if provided
-        if chat_history:
-            messages.extend(chat_history)
-            
-        # Add the current user query
-        messages.append({"role": "user", "content": user_query})
-
-        config = ConfigHandler().load_config()
-        CHAT_MODEL = config.get("chat_model_name")
-        log_event("PROCESS", f"Sending message to OpenAI GPT with {len(messages)} total messages.")
-        
-        if max_tokens:
-            response = client.chat.completions.create(
-                model=CHAT_MODEL,
-                messages=messages,
-                temperature=temp,
-                max_tokens=max_tokens
-            )
-        else:
-            response = client.chat.completions.create(
-                model=CHAT_MODEL,
-                messages=messages,
-                temperature=temp
-            )
-        
+        request = _chat_request(system_prompt, user_query, temp, max_tokens, chat_history)
+        with openai_request_seconds.time(operation="chat", model=request["model"]):
+            response = client.chat.completions.create(**request)
+        record_usage(request["model"], response.usage)
 
         message = response.choices[0].message.content
         log_event("SUCCESS", "Received response from OpenAI GPT.")
@@ -53,20 +71,172 @@ def chat_with_gpt(system_prompt: str, user_query: str, temp: float, max_tokens=N
         raise e
 
 
+async def achat_with_gpt(system_prompt: str, user_query: str, temp: float, max_tokens=None, chat_history: List[Dict] = None) -> str:
+    try:
+        request = _chat_request(system_prompt, user_query, temp, max_tokens, chat_history)
+        with openai_request_seconds.time(operation="chat", model=request["model"]):
+            response = await async_client.chat.completions.create(**request)
+        record_usage(request["model"], response.usage)
+
+        message = response.choices[0].message.content
+        log_event("SUCCESS", "Received response from OpenAI GPT.")
+        return message
+
+    except Exception as e:
+        log_event("ERROR", f"Error in achat_with_gpt: {e}")
+        raise e
+
+
+async def astream_chat_with_gpt(system_prompt: str, user_query: str, temp: float, max_tokens=None, chat_history: List[Dict] = None) -> AsyncIterator[str]:
+    try:
+        request = _chat_request(system_prompt, user_query, temp, max_tokens, chat_history)
+        async def chunks():
+            stream = await async_client.chat.completions.create(
+                **request, stream=True, stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                yield chunk
+
+        # Timed while waiting on the API only; usage arrives in a final chunk without choices.
+        async for chunk in openai_request_seconds.time_stream(chunks(), operation="chat_stream", model=request["model"]):
+            if not chunk.choices:
+                record_usage(request["model"], chunk.usage)
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+        log_event("SUCCESS", "Finished streaming response from OpenAI GPT.")
+
+    except Exception as e:
+        log_event("ERROR", f"Error in astream_chat_with_gpt: {e}")
+        raise e
+
+
+def embedding_settings(config: Dict) -> Tuple[str, str, Dict]:
+    model = config.get("embedding_model_name")
+    dimensions = config.get("embedding_dimensions")
+    # Shortened vectors are different vectors, so they are cached under their own key.
+    cache_model = f"{model}@{dimensions}" if dimensions else model
+    return model, cache_model, ({"dimensions": dimensions} if dimensions else {})
+
+
 def embed_text(text: str) -> List[float]:
     try:
         config = ConfigHandler().load_config()
-        EMBEDDING_MODEL = config.get("embedding_model_name")
+        EMBEDDING_MODEL, cache_model, options = embedding_settings(config)
+        cache_enabled = config.get("embedding_cache_enabled", True)
 
+        if cache_enabled:
+            cached = embedding_cache.get(cache_model, text)
+            if cached is not None:
+                return cached
 
-        response = client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=text
-        )
+        with openai_request_seconds.time(operation="embedding", model=EMBEDDING_MODEL):
+            response = client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=text,
+                **options
+            )
+        record_usage(EMBEDDING_MODEL, response.usage)
 
         embedding = response.data[0].embedding
+
+        if cache_enabled:
+            max_bytes = config.get("embedding_cache_max_mb", 256) * 1024 * 1024
+            embedding_cache.put(cache_model, text, embedding, max_bytes=max_bytes)
+
         return embedding
 
     except Exception as e:
         log_event("ERROR", f"Error in embedding text using OpenAI: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+async def aembed_text(text: str) -> List[float]:
+    try:
+        config = ConfigHandler().load_config()
+        EMBEDDING_MODEL, cache_model, options = embedding_settings(config)
+        cache_enabled = config.get("embedding_cache_enabled", True)
+
+        # The SQLite cache blocks, so it is read and written off the event loop.
+        if cache_enabled:
+            cached = await asyncio.to_thread(embedding_cache.get, cache_model, text)
+            if cached is not None:
+                return cached
+
+        with openai_request_seconds.time(operation="embedding", model=EMBEDDING_MODEL):
+            response = await async_client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=text,
+                **options
+            )
+        record_usage(EMBEDDING_MODEL, response.usage)
+
+        embedding = response.data[0].embedding
+
+        if cache_enabled:
+            max_bytes = config.get("embedding_cache_max_mb", 256) * 1024 * 1024
+            await asyncio.to_thread(embedding_cache.put, cache_model, text, embedding, max_bytes=max_bytes)
+
+        return embedding
+
+    except Exception as e:
+        log_event("ERROR", f"Error in embedding text using OpenAI: {e}")
+        raise e
+
+def _embed_batch(model: str, texts: List[str], options: Dict) -> List[List[float]]:
+    with openai_request_seconds.time(operation="embedding_batch", model=model):
+        response = client.embeddings.create(
+            model=model,
+            input=texts,
+            **options
+        )
+    record_usage(model, response.usage)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    try:
+        if not texts:
+            return []
+
+        config = ConfigHandler().load_config()
+        EMBEDDING_MODEL, cache_model, options = embedding_settings(config)
+        max_batch_tokens = config.get("embedding_batch_max_tokens", 100000)
+        max_batch_inputs = config.get("embedding_batch_max_inputs", 256)
+        concurrency = max(1, config.get("embedding_concurrency", 4))
+        cache_enabled = config.get("embedding_cache_enabled", True)
+
+        if cache_enabled:
+            embeddings = embedding_cache.get_many(cache_model, texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        # Identical texts within one upload (e.g. repeated sections) are embedded once.
+        missing_texts = list(dict.fromkeys(text for text, vector in zip(texts, embeddings) if vector is None))
+        log_event("INFO", f"Embedding cache: {len(texts) - embeddings.count(None)} hits, {embeddings.count(None)} misses.")
+
+        if missing_texts:
+            batches = token_handler.batch_by_tokens(missing_texts, max_tokens=max_batch_tokens, max_items=max_batch_inputs)
+            workers = min(concurrency, len(batches))
+            log_event("PROCESS", f"Embedding {len(missing_texts)} texts in {len(batches)} batches ({workers} in flight).")
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda batch: _embed_batch(EMBEDDING_MODEL, batch, options), batches))
+
+            missing_vectors = [vector for batch_vectors in results for vector in batch_vectors]
+
+            if cache_enabled:
+                max_bytes = config.get("embedding_cache_max_mb", 256) * 1024 * 1024
+                embedding_cache.put_many(cache_model, missing_texts, missing_vectors, max_bytes=max_bytes)
+
+            fetched = dict(zip(missing_texts, missing_vectors))
+            embeddings = [vector if vector is not None else fetched[text] for text, vector in zip(texts, embeddings)]
+
+        log_event("SUCCESS", f"Embedded {len(embeddings)} texts.")
+        return embeddings
+
+    except Exception as e:
+        log_event("ERROR", f"Error in batch embedding texts using OpenAI: {e}")
+        raise e
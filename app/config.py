@@ -1,16 +1,36 @@
 import os
 
-FILES_DIR = "/app/data/files"
-CHUNKS_DIR = "/app/data/chunks"
-INDEX_DIR = "/app/data/indexes"
-CONFIG_PATH = "/app/data/config.json"
-LOGS_FILE = "/app/data/logs/logs.log"
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+FILES_DIR = os.path.join(DATA_DIR, "files")
+CHUNKS_DIR = os.path.join(DATA_DIR, "chunks")
+INDEX_DIR = os.path.join(DATA_DIR, "indexes")
+CONFIG_PATH = os.path.join(DATA_DIR, "config.json")
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.sqlite3")
+LOGS_FILE = os.path.join(DATA_DIR, "logs", "logs.log")
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
 ALLOWED_FILE_EXTENSIONS = [".pdf"]
+INDEX_REFRESH_INTERVAL = 5
+INDEX_MMAP = os.getenv("INDEX_MMAP", "false").lower() in ("1", "true", "yes")
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = 32
+LOG_LEVEL = os.getenv("LOG_LEVEL", "PROCESS").upper()
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_TO_STDOUT = os.getenv("LOG_TO_STDOUT", "true").lower() in ("1", "true", "yes")
 
 os.makedirs(FILES_DIR, exist_ok=True)
 os.makedirs(CHUNKS_DIR, exist_ok=True)
 os.makedirs(INDEX_DIR, exist_ok=True)
+os.makedirs(JOBS_DIR, exist_ok=True)
 os.makedirs(os.path.dirname(LOGS_FILE), exist_ok=True)
 
 query_type_prompt = """
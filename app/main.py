@@ -1,17 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
 from typing import List, Dict, Optional
 import os, sys
+import json
+import hashlib
+from uuid import uuid4
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.pipelines.query_pipeline import query_pipeline
-from app.pipelines.file_pipeline import file_upload_pipeline, file_delete_pipeline
+from app.pipelines.query_pipeline import aquery_pipeline, aquery_pipeline_stream
+from app.pipelines.file_pipeline import file_upload_pipeline, file_update_pipeline, file_delete_pipeline
 from utils.config_handler import ConfigHandler
-from utils.logger import log_event
-from app.config import FILES_DIR, LOGS_FILE
+from utils.logger import log_event, request_id_var
+from utils.log_reader import read_logs, follow_logs
+from utils.index_registry import index_registry
+from utils.response_cache import response_cache
+from utils.job_handler import JobHandler
+from utils.embedding_cache import embedding_cache
+from utils.metrics import metrics
+from app.api.openai_client import async_client
+from utils.file_handler import FileHandler, query_vector_cache
+from app.config import FILES_DIR, LOGS_FILE, UPLOAD_CHUNK_SIZE, MAX_UPLOAD_BYTES
 
 app = FastAPI(title="Document QA API")
 
@@ -24,7 +37,58 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    # Every log record written while serving the request carries this id.
+    request_id = request.headers.get("X-Request-ID") or uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
 config_handler = ConfigHandler()
+file_handler = FileHandler()
+job_handler = JobHandler(runners={"upload": file_upload_pipeline, "update": file_update_pipeline})
+
+
+def collect_cache_and_index_metrics():
+    caches = {
+        "embedding": embedding_cache,
+        "query_vector": query_vector_cache,
+        "response": response_cache,
+    }
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    return [
+        ("meal_assistant_cache_hits_total", "counter", "Cache lookups that were served from the cache.",
+         [({"cache": name}, s["hits"]) for name, s in stats.items()]),
+        ("meal_assistant_cache_misses_total", "counter", "Cache lookups that missed.",
+         [({"cache": name}, s["misses"]) for name, s in stats.items()]),
+        ("meal_assistant_cache_entries", "gauge", "Entries currently held in each cache.",
+         [({"cache": name}, s["entries"]) for name, s in stats.items()]),
+        ("meal_assistant_index_vectors", "gauge", "Live vectors in the corpus index.",
+         [({}, index_registry.vector_count)]),
+        ("meal_assistant_index_files", "gauge", "Files loaded into the corpus index.",
+         [({}, index_registry.file_count)]),
+    ]
+
+
+metrics.register_collector(collect_cache_and_index_metrics)
+
+
+@app.on_event("startup")
+def load_indexes():
+    index_registry.refresh(force=True)
+    job_handler.resume_pending()
+
+
+@app.on_event("shutdown")
+async def close_openai_client():
+    await async_client.close()
+
 
 class ChatMessage(BaseModel):
     role: str
@@ -67,14 +131,38 @@ def get_server_time():
 
 
 @app.get("/logs")
-def get_logs():
+def get_logs(offset: int = 0, limit: int = 200, level: Optional[str] = None, since: Optional[str] = None,
+             until: Optional[str] = None, request_id: Optional[str] = None):
     if not os.path.exists(LOGS_FILE):
         raise HTTPException(status_code=404, detail="Log file not found")
+    if offset < 0 or not 0 < limit <= 1000:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 1000.")
 
-    with open(LOGS_FILE, "r") as f:
-        logs = f.read()
-    return {"logs": logs}
+    try:
+        return read_logs(offset=offset, limit=limit, level=level, since=since, until=until, request_id=request_id)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid log filter: {e}")
+
+
+@app.get("/logs/tail")
+async def tail_logs(request: Request, lines: int = 50):
+    if not os.path.exists(LOGS_FILE):
+        raise HTTPException(status_code=404, detail="Log file not found")
+
+    async def events():
+        async for record in follow_logs(lines=min(max(lines, 0), 1000)):
+            if await request.is_disconnected():
+                break
+            yield f"data: {json.dumps(record, ensure_ascii=False)}\n\n"
 
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+
+@app.get("/metrics")
+def get_metrics():
+    # Scraped every few seconds, so not logged.
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/files")
@@ -101,13 +189,13 @@ def get_config():
 
 
 @app.post("/ask")
-def ask_route(request: QueryRequest):
+async def ask_route(request: QueryRequest):
     try:
         log_event("PROCESS", "Processing query has started!")
 
         chat_history = [{"role": msg.role, "content": msg.content} for msg in request.chat_history]
 
-        response, counts_toward_limit = query_pipeline(request.query, chat_history)
+        response, counts_toward_limit = await aquery_pipeline(request.query, chat_history)
         log_event("SUCCESS", "Query is processed successfully.")
         return {
             "response": response,
@@ -121,10 +209,33 @@ def ask_route(request: QueryRequest):
 
 
 
+@app.post("/ask/stream")
+async def ask_stream_route(request: QueryRequest):
+    log_event("PROCESS", "Processing streamed query has started!")
+
+    chat_history = [{"role": msg.role, "content": msg.content} for msg in request.chat_history]
+
+    async def event_stream():
+        try:
+            async for event, data in aquery_pipeline_stream(request.query, chat_history):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            log_event("SUCCESS", "Streamed query is processed successfully.")
+        except Exception as e:
+            log_event("ERROR", f"An error occurred while streaming query: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': f'Failed to process query: {str(e)}'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/config")
 def update_config(updates: dict):
     try:
         updated_config = config_handler.update_config(updates)
+        response_cache.clear()
         log_event("SUCCESS", "Configuration updated successfully.")
         return updated_config
     except Exception as e:
@@ -132,24 +243,103 @@ def update_config(updates: dict):
         raise HTTPException(status_code=500, detail="Unable to update configuration")
 
 
-@app.post("/upload")
-async def upload_pdf(file: UploadFile = File(...)):
+async def save_upload(file: UploadFile, tmp_path: str) -> str:
+    # Streams the upload to disk in fixed-size chunks, hashing as it goes.
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(tmp_path, "wb") as f:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+            sha256.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+    return sha256.hexdigest()
+
+
+@app.post("/upload", status_code=202)
+async def upload_pdf(response: Response, file: UploadFile = File(...)):
     filename = os.path.splitext(file.filename)[0]
 
     file_path = os.path.join(FILES_DIR, f"{filename}.pdf")
-    if os.path.exists(file_path):
-        log_event("ERROR", f"Upload failed: {filename}.pdf already exists.")
-        raise HTTPException(status_code=400, detail="File already exists.")
+    tmp_path = os.path.join(FILES_DIR, f".{filename}.{uuid4().hex}.upload")
 
     try:
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+        sha256 = await save_upload(file, tmp_path)
+
+        # Linking claims the name atomically: of two concurrent uploads, only one can create it.
+        try:
+            os.link(tmp_path, file_path)
+        except FileExistsError:
+            if sha256 == file_handler.get_file_hash(filename) and file_handler.is_indexed(filename):
+                log_event("SUCCESS", f"Upload of {filename}.pdf skipped: identical to the stored file.")
+                response.status_code = 200
+                return {"message": f"{filename}.pdf is unchanged, nothing to process.", "job_id": None}
+
+            log_event("ERROR", f"Upload failed: {filename}.pdf already exists.")
+            raise HTTPException(status_code=400, detail="File already exists.")
+
+        file_handler.save_file_hash(filename, sha256)
         log_event("SUCCESS", f"File {filename}.pdf uploaded successfully.")
-        file_upload_pipeline(filename)
-        return {"message": f"{filename}.pdf uploaded and processed successfully."}
+        job = job_handler.submit("upload", filename)
+        return {
+            "message": f"{filename}.pdf uploaded and queued for processing.",
+            "job_id": job["id"],
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         log_event("ERROR", f"File upload failed: {e}")
         raise HTTPException(status_code=500, detail="Upload failed. Check logs.")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@app.put("/files/{filename}", status_code=202)
+async def update_pdf(filename: str, response: Response, file: UploadFile = File(...)):
+    file_path = os.path.join(FILES_DIR, f"{filename}.pdf")
+    tmp_path = os.path.join(FILES_DIR, f".{filename}.{uuid4().hex}.upload")
+
+    if not os.path.exists(file_path):
+        log_event("ERROR", f"Update failed: {filename}.pdf not found.")
+        raise HTTPException(status_code=404, detail="File not found.")
+
+    try:
+        sha256 = await save_upload(file, tmp_path)
+
+        if sha256 == file_handler.get_file_hash(filename) and file_handler.is_indexed(filename):
+            log_event("SUCCESS", f"Update of {filename}.pdf skipped: identical to the stored file.")
+            response.status_code = 200
+            return {"message": f"{filename}.pdf is unchanged, nothing to process.", "job_id": None}
+
+        os.replace(tmp_path, file_path)
+        file_handler.save_file_hash(filename, sha256)
+        log_event("SUCCESS", f"File {filename}.pdf replaced, queued for re-indexing.")
+        job = job_handler.submit("update", filename)
+        return {
+            "message": f"{filename}.pdf updated and queued for re-indexing.",
+            "job_id": job["id"],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_event("ERROR", f"File update failed for {filename}: {e}")
+        raise HTTPException(status_code=500, detail="Update failed. Check logs.")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_handler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
 
 @app.delete("/delete/{filename}")
@@ -161,10 +351,18 @@ def delete_file(filename: str):
         raise HTTPException(status_code=404, detail="File not found.")
 
     try:
-        os.remove(file_path)
-        file_delete_pipeline(filename)
+        # Queued jobs for the file are dropped and a running one stops at its next stage;
+        # the file lock waits for it, so nothing writes the index after it is removed.
+        job_handler.cancel_file_jobs(filename)
+        with job_handler.file_lock(filename):
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail="File not found.")
+            os.remove(file_path)
+            file_delete_pipeline(filename)
         log_event("SUCCESS", f"{filename}.pdf and associated data deleted.")
         return {"message": f"{filename}.pdf deleted successfully."}
+    except HTTPException:
+        raise
     except Exception as e:
         log_event("ERROR", f"Deletion failed for {filename}: {e}")
         raise HTTPException(status_code=500, detail="Deletion failed. Check logs.")
\ No newline at end of file
@@ -1,45 +1,94 @@
 import os, sys
+from typing import Callable, Optional
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.file_handler import FileHandler
 from utils.logger import log_event
+from utils.index_registry import index_registry
+from utils.response_cache import response_cache
 
 file_handler = FileHandler()
 
 
-def file_upload_pipeline(file_name: str):
+def file_upload_pipeline(file_name: str, progress: Optional[Callable] = None):
+    if progress is None:
+        progress = lambda stage, **details: None
     
     try:
-        log_event("PROCESS", "Extracting text from PDF has started!")
-        text = file_handler.extract_text_from_pdf(file_name)
-        log_event("SUCCESS", f"Extracting text from PDF is completed.")
+        progress("extracting")
+        log_event("PROCESS", "Extracting, chunking and embedding PDF text has started!")
+        config = file_handler.config_handler.load_config()
+        pages = file_handler.iter_pdf_text(file_name)
+        chunks, embeddings = file_handler.embed_chunk_stream(
+            file_handler.iter_chunks(pages, file_name=file_name),
+            batch_size=config.get("embedding_batch_max_inputs", 256),
+            concurrency=config.get("embedding_concurrency", 4),
+            progress=progress,
+        )
+        log_event("SUCCESS", f"Extraction and embedding completed. Total chunks: {len(chunks)}.")
     except Exception as e:
-        log_event("ERROR", f"An error occurred while extracting text from PDF: {e}")
+        log_event("ERROR", f"An error occurred while extracting and embedding PDF text: {e}")
         raise e
 
     try:
-        log_event("PROCESS", "Chunking text has started!")
-        chunks = file_handler.chunk_text(full_text=text, file_name=file_name)
-        log_event("SUCCESS", f"Chunking completed. Total chunks: {len(chunks)}.")
+        progress("indexing", chunks=len(chunks))
+        log_event("PROCESS", "Saving FAISS index and chunks has started!")
+        file_handler.save_chunks_and_index(chunks, embeddings, file_name)
+        index_registry.load_file(file_name)
+        response_cache.clear()
+        log_event("SUCCESS", "Saving index and chunks completed.")
     except Exception as e:
-        log_event("ERROR", f"An error occurred while chunking text: {e}")
+        log_event("ERROR", f"An error occurred while saving index and chunks: {e}")
         raise e
 
+
+def file_update_pipeline(file_name: str, progress: Optional[Callable] = None):
+    if progress is None:
+        progress = lambda stage, **details: None
+
+    if not file_handler.is_indexed(file_name):
+        log_event("INFO", f"No index found for {file_name}, running a full ingestion instead.")
+        file_upload_pipeline(file_name, progress=progress)
+        return
+
     try:
-        log_event("PROCESS", "Embedding chunks has started!")
-        embeddings = file_handler.embed_chunks(chunks)
-        log_event("SUCCESS", "Embedding completed.")
+        progress("extracting")
+        log_event("PROCESS", f"Extracting updated sections of {file_name} has started!")
+        pages = file_handler.iter_pdf_text(file_name)
+        new_chunks = list(file_handler.iter_chunks(pages, file_name=file_name))
+        added, removed_rows = file_handler.diff_chunks(file_name, new_chunks)
+        log_event(
+            "SUCCESS",
+            f"Section diff for {file_name}: {len(added)} added or changed, {len(removed_rows)} removed, "
+            f"{len(new_chunks) - len(added)} unchanged.",
+        )
     except Exception as e:
-        log_event("ERROR", f"An error occurred while embedding chunks: {e}")
+        log_event("ERROR", f"An error occurred while diffing sections of {file_name}: {e}")
         raise e
 
     try:
-        log_event("PROCESS", "Saving FAISS index and chunks has started!")
-        file_handler.save_chunks_and_index(chunks, embeddings, file_name)
-        log_event("SUCCESS", "Saving index and chunks completed.")
+        progress("embedding", chunks=len(added))
+        log_event("PROCESS", "Embedding changed sections has started!")
+        embeddings = file_handler.embed_chunks(added) if added else []
+        log_event("SUCCESS", "Embedding changed sections completed.")
     except Exception as e:
-        log_event("ERROR", f"An error occurred while saving index and chunks: {e}")
+        log_event("ERROR", f"An error occurred while embedding changed sections: {e}")
+        raise e
+
+    try:
+        progress("indexing", chunks=len(added), removed=len(removed_rows))
+        log_event("PROCESS", "Updating FAISS index and chunks has started!")
+        chunks, first_row, vectors_np = file_handler.apply_chunk_diff(file_name, added, embeddings, removed_rows)
+        if file_handler.compact_chunks_and_index(file_name):
+            log_event("INFO", f"Compacted tombstoned rows out of the {file_name} index.")
+            index_registry.load_file(file_name)
+        else:
+            index_registry.apply_diff(file_name, chunks, removed_rows, first_row, vectors_np)
+        response_cache.clear()
+        log_event("SUCCESS", "Updating index and chunks completed.")
+    except Exception as e:
+        log_event("ERROR", f"An error occurred while updating index and chunks: {e}")
         raise e
 
 
@@ -47,6 +96,8 @@ def file_delete_pipeline(file_name: str):
     try:
         log_event("PROCESS", f"Attempting to delete index and chunk files for: {file_name}")
         file_handler.delete_data_files(file_name)
+        index_registry.remove_file(file_name)
+        response_cache.clear()
         log_event("SUCCESS", f"Files related to {file_name} were deleted successfully.")
     except Exception as e:
         log_event("ERROR", f"An error occurred while deleting files for {file_name}: {e}")
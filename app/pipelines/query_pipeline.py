@@ -1,44 +1,84 @@
 import os, sys
-import re
-from typing import Tuple, List, Dict
+import asyncio
+from typing import AsyncIterator, Tuple, List, Dict, Optional
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.file_handler import FileHandler
-from utils.logger import log_event
-from app.api.openai_client import chat_with_gpt
+from utils.logger import log_event, log_enabled
 from app.config import query_type_prompt, meal_type_prompt
 from utils.token_handler import TokenHandler
 from utils.config_handler import ConfigHandler
 from utils.query_handler import QueryHandler, PipelineReturn
+from utils.response_cache import response_cache
+from utils.index_registry import index_registry
+from utils.metrics import query_stage_seconds
 query_handler = QueryHandler()
 file_handler = FileHandler()
 token_handler = TokenHandler()
 
 
-def query_pipeline(user_query: str, chat_history: List[Dict] = None) -> Tuple[str, bool]:
+# Model and index calls the shared pipeline steps hand to their driver, by name.
+SYNC_OPERATIONS = {
+    "identify": query_handler.identify_query,
+    "get_type": query_handler.get_type,
+    "embed_query": file_handler.embed_query,
+    "search": file_handler.search_all_indexes,
+}
+ASYNC_OPERATIONS = {
+    "identify": query_handler.aidentify_query,
+    "get_type": query_handler.aget_type,
+    "embed_query": file_handler.aembed_query,
+    "search": file_handler.asearch_all_indexes,
+}
+
+
+def _prepare_steps(user_query: str, chat_history: List[Dict] = None):
+    # Every step before the final completion, written once for the sync and async pipelines:
+    # each call is yielded as (operation, kwargs) and its result sent back by the driver.
+    # Early answers, including cached ones, are raised as PipelineReturn.
     config = ConfigHandler().load_config()
     base_prompt = config.get("base_prompt")
-    counts_toward_limit = True
-    
+
+    response_cache.configure(config)
+    use_response_cache = response_cache.enabled and not chat_history
+    if use_response_cache:
+        cache_key_query = query_handler.sanitize_query(user_query)
+        cache_fingerprint = response_cache.fingerprint(config)
+        cached = response_cache.get_exact(cache_key_query, cache_fingerprint)
+        if cached:
+            raise PipelineReturn(*cached)
+
+    type_kwargs = {"query": user_query, "prompt": meal_type_prompt, "temp": 0.1}
+
+    # Speculative mode starts meal typing and retrieval alongside classification and
+    # throws that work away when the query turns out not to be a new food query.
+    if config.get("speculative_execution", False):
+        log_event("PROCESS", "Starting meal typing and retrieval speculatively.")
+        yield "speculate", {"get_type": type_kwargs, "search": {"query": query_handler.sanitize_query(user_query)}}
+
     try:
         log_event("PROCESS", "Identifying query.")
-        query_handler.identify_query(query=user_query, prompt=query_type_prompt, chat_history=chat_history, temp=0.1)
+        with query_stage_seconds.time(stage="identify"):
+            yield "identify", {"query": user_query, "prompt": query_type_prompt, "chat_history": chat_history, "temp": 0.1}
         log_event("SUCCESS", "Query is valid.")
 
-
-    except PipelineReturn as pr:
-        return pr.value, pr.counts_toward_limit
+    except PipelineReturn:
+        raise
     except Exception as e:
         log_event("ERROR", f"An error occured during getting query type: {e}")
         raise e
-    
+
     try:
         log_event("PROCESS", "Getting meal type.")
-        meal_type = query_handler.get_type(query=user_query, prompt=meal_type_prompt, temp=0.1)
+        # With speculative execution this only counts the wait left after classification.
+        with query_stage_seconds.time(stage="get_type"):
+            meal_type = yield "get_type", type_kwargs
         log_event("SUCCESS", f"Meal type is: {meal_type}")
     except PipelineReturn as pr:
-        return pr.value, pr.counts_toward_limit
+        if use_response_cache:
+            response_cache.store(cache_key_query, cache_fingerprint, "D", pr.value, pr.counts_toward_limit)
+        raise
     except Exception as e:
         log_event("ERROR", "An error occured during getting meal type")    
         raise e    
@@ -47,34 +87,183 @@ def query_pipeline(user_query: str, chat_history: List[Dict] = None) -> Tuple[st
         log_event("PROCESS", "Sanitizing user query.")
         sanitized_query = query_handler.sanitize_query(user_query)
         log_event("SUCCESS", "Query sanitized successfully.")
+
+        query_vector_np = None
+        if response_cache.mode == "semantic" and use_response_cache:
+            query_vector_np = yield "embed_query", {"query": sanitized_query}
+            cached = response_cache.get_similar(query_vector_np, meal_type, cache_fingerprint)
+            if cached:
+                raise PipelineReturn(*cached)
         
         log_event("PROCESS", "Searching for relevant content from all indexes.")
-        relevant_chunks = file_handler.search_all_indexes(sanitized_query)
+        relevant_chunks = yield "search", {"query": sanitized_query}
         log_event("SUCCESS", f"Found {len(relevant_chunks)}.")
 
+    except PipelineReturn:
+        raise
     except Exception as e:
         log_event("ERROR", f"An error occurred during search: {e}")
         raise e
     
     try:
         log_event("PROCESS", "Building prompt with retrieved chunks.")
-        full_system_prompt, sanitized_query = token_handler.build_prompt_within_limit(
-            base_prompt, sanitized_query, relevant_chunks
-        )
+        with query_stage_seconds.time(stage="prompt_build"):
+            full_system_prompt, sanitized_query = token_handler.build_prompt_within_limit(
+                base_prompt, sanitized_query, relevant_chunks, preamble_for=index_registry.preamble_for
+            )
         log_event("SUCCESS", "Prompt built successfully.")
 
     except Exception as e:
         log_event("ERROR", f"An error occurred while building the prompt: {e}")
         raise e
 
+    return {
+        "prompt": full_system_prompt,
+        "query": sanitized_query,
+        "meal_type": meal_type,
+        "cache_key_query": cache_key_query if use_response_cache else None,
+        "cache_fingerprint": cache_fingerprint if use_response_cache else None,
+        "query_vector_np": query_vector_np,
+    }
+
+
+def _prepare_final_request(user_query: str, chat_history: List[Dict] = None) -> Dict:
+    steps = _prepare_steps(user_query, chat_history)
+    result, error = None, None
+    while True:
+        try:
+            operation, kwargs = steps.throw(error) if error else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            # Nothing runs concurrently here, so speculation has nothing to start.
+            result = None if operation == "speculate" else SYNC_OPERATIONS[operation](**kwargs)
+            error = None
+        except Exception as e:
+            result, error = None, e
+
+
+def _discard_tasks(*tasks: Optional[asyncio.Task]) -> None:
+    for task in tasks:
+        if task is None:
+            continue
+        task.cancel()
+        # Retrieve the outcome so abandoned tasks don't warn about unretrieved exceptions.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def _aprepare_final_request(user_query: str, chat_history: List[Dict] = None) -> Dict:
+    steps = _prepare_steps(user_query, chat_history)
+    speculative = {}
+    result, error = None, None
+    try:
+        while True:
+            try:
+                operation, kwargs = steps.throw(error) if error else steps.send(result)
+            except StopIteration as done:
+                return done.value
+            try:
+                if operation == "speculate":
+                    speculative = {name: asyncio.create_task(ASYNC_OPERATIONS[name](**op_kwargs)) for name, op_kwargs in kwargs.items()}
+                    result = None
+                elif operation in speculative:
+                    result = await speculative.pop(operation)
+                else:
+                    result = await ASYNC_OPERATIONS[operation](**kwargs)
+                error = None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        # Speculative work that an early answer made unnecessary.
+        _discard_tasks(*speculative.values())
+
+
+def query_pipeline(user_query: str, chat_history: List[Dict] = None) -> Tuple[str, bool]:
+    counts_toward_limit = True
+
+    try:
+        request = _prepare_final_request(user_query, chat_history)
+    except PipelineReturn as pr:
+        return pr.value, pr.counts_toward_limit
+
     try:
         log_event("PROCESS", "Sending query to GPT.")
-        response = query_handler.get_final_response(prompt=full_system_prompt, query=sanitized_query, temp=0.6, type=meal_type)
+        with query_stage_seconds.time(stage="final_completion"):
+            response = query_handler.get_final_response(prompt=request["prompt"], query=request["query"], temp=0.6, type=request["meal_type"])
         log_event("SUCCESS", "Received response from GPT.")
-        log_event("INFO", f": User Query:\n\n{sanitized_query}\n\nFull System prompt 'Base prompt + Chunks':\n\n{full_system_prompt}\n\nGPT output:\n\n{response}")
+        _log_final_response(request, response)
+
+        _store_final_response(request, response, counts_toward_limit)
         
         return response, counts_toward_limit
     
     except Exception as e:
         log_event("ERROR", f"An error occurred while querying GPT: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+def _log_final_response(request: Dict, response: str) -> None:
+    # One record per answer on every path (sync, async and streamed); payloads are DEBUG only.
+    if log_enabled("DEBUG"):
+        log_event("DEBUG", f": User Query:\n\n{request['query']}\n\nFull System prompt 'Base prompt + Chunks':\n\n{request['prompt']}\n\nGPT output:\n\n{response}")
+
+
+def _store_final_response(request: Dict, response: str, counts_toward_limit: bool) -> None:
+    if request["cache_key_query"] is not None:
+        response_cache.store(
+            request["cache_key_query"], request["cache_fingerprint"], request["meal_type"],
+            response, counts_toward_limit, request["query_vector_np"]
+        )
+
+
+async def aquery_pipeline(user_query: str, chat_history: List[Dict] = None) -> Tuple[str, bool]:
+    counts_toward_limit = True
+
+    try:
+        request = await _aprepare_final_request(user_query, chat_history)
+    except PipelineReturn as pr:
+        return pr.value, pr.counts_toward_limit
+
+    try:
+        log_event("PROCESS", "Sending query to GPT.")
+        with query_stage_seconds.time(stage="final_completion"):
+            response = await query_handler.aget_final_response(prompt=request["prompt"], query=request["query"], temp=0.6, type=request["meal_type"])
+        log_event("SUCCESS", "Received response from GPT.")
+        _log_final_response(request, response)
+
+        _store_final_response(request, response, counts_toward_limit)
+        
+        return response, counts_toward_limit
+    
+    except Exception as e:
+        log_event("ERROR", f"An error occurred while querying GPT: {e}")
+        raise e
+
+
+async def aquery_pipeline_stream(user_query: str, chat_history: List[Dict] = None) -> AsyncIterator[Tuple[str, Dict]]:
+    counts_toward_limit = True
+
+    try:
+        request = await _aprepare_final_request(user_query, chat_history)
+    except PipelineReturn as pr:
+        yield "answer", {"response": pr.value, "counts_toward_limit": pr.counts_toward_limit}
+        return
+
+    try:
+        log_event("PROCESS", "Streaming query to GPT.")
+        parts = []
+        tokens = query_handler.astream_final_response(prompt=request["prompt"], query=request["query"], temp=0.6, type=request["meal_type"])
+        async for token in query_stage_seconds.time_stream(tokens, stage="final_completion"):
+            parts.append(token)
+            yield "token", {"content": token}
+        log_event("SUCCESS", "Finished streaming response from GPT.")
+        response = "".join(parts)
+        _log_final_response(request, response)
+
+        _store_final_response(request, response, counts_toward_limit)
+
+        yield "done", {"counts_toward_limit": counts_toward_limit}
+
+    except Exception as e:
+        log_event("ERROR", f"An error occurred while streaming from GPT: {e}")
+        raise e
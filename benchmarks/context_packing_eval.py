@@ -0,0 +1,108 @@
+import os, sys
+import argparse
+import json
+import random
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from benchmarks.stub_openai_server import fake_embedding
+from utils.file_handler import FileHandler
+from utils.token_handler import TokenHandler
+
+# Compares context packing modes on a fixed synthetic corpus and query set. Retrieval uses
+# the stub server's hashed embeddings, so results are reproducible without API calls.
+
+TOPICS = {
+    "rice": "white rice basmati jasmine cooled reheated starch",
+    "oats": "oats porridge oatmeal breakfast bran",
+    "bread": "bread sourdough wholegrain toast sandwich",
+    "pasta": "pasta spaghetti noodles al dente",
+    "fruit": "fruit banana apple berries mango",
+    "dairy": "yogurt milk cheese kefir",
+    "legumes": "lentils chickpeas beans hummus",
+    "sweets": "dessert cake chocolate cookies sugar",
+}
+FILLER = "walk after meals pair carbs with protein add vinegar eat vegetables first portion size".split()
+
+EVAL_QUERIES = [
+    ("rice", "I am having white rice with dinner"),
+    ("rice", "is jasmine rice okay if cooled and reheated"),
+    ("oats", "oatmeal porridge for breakfast"),
+    ("bread", "sourdough toast sandwich at lunch"),
+    ("pasta", "spaghetti noodles tonight"),
+    ("fruit", "a banana and some berries"),
+    ("dairy", "greek yogurt with milk"),
+    ("legumes", "lentils and chickpeas hummus"),
+    ("sweets", "chocolate cake dessert"),
+    ("sweets", "cookies with sugar"),
+    ("oats", "bran breakfast oats"),
+    ("fruit", "mango and apple snack"),
+]
+
+
+def synthetic_corpus(rng: random.Random, files: int, sections_per_topic: int) -> str:
+    texts = []
+    for f in range(files):
+        text = "Section: General rules\n" + " ".join(rng.choices(FILLER, k=120)) + "\n"
+        for topic, words in TOPICS.items():
+            for s in range(sections_per_topic):
+                # Mostly short sections, with the occasional very long one.
+                length = rng.choice([40, 60, 80, 100, 900])
+                body = " ".join(rng.choices(words.split() * 3 + FILLER, k=length))
+                text += f"Section: {topic.title()} note {s}\n{body}\n"
+        # A section copied verbatim into every file, as shared guidance often is.
+        text += "Section: Rice basics\nwhite rice cooled reheated with vinegar and protein\n"
+        texts.append(text)
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare context packing modes.")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--sections-per-topic", type=int, default=4)
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--budget", type=int, default=1500, help="Context token budget per prompt.")
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    file_handler = FileHandler()
+    token_handler = TokenHandler()
+
+    chunks = []
+    for f, text in enumerate(synthetic_corpus(rng, args.files, args.sections_per_topic)):
+        chunks.extend(file_handler.iter_chunks([text], file_name=f"manual_{f}"))
+    preambles = {chunk["file"]: chunk for chunk in chunks if chunk.get("preamble")}
+    preamble_for = lambda chunk: preambles.get(chunk.get("file"))
+    vectors = np.array([fake_embedding(chunk["content"], args.dimension) for chunk in chunks], dtype="float32")
+
+    report = {}
+    for mode in ("greedy", "score_per_token"):
+        totals = {"score": 0.0, "tokens": 0, "chunks": 0, "relevant_chunks": 0, "distinct_relevant_chunks": 0}
+        for topic, query in EVAL_QUERIES:
+            scores = vectors @ np.array(fake_embedding(query, args.dimension), dtype="float32")
+            top = np.argsort(-scores)[:args.top_k]
+            retrieved = [(chunks[i], float(scores[i])) for i in top]
+            score_by_content = {c["content"]: s for c, s in retrieved}
+
+            packed, used = token_handler.pack_chunks(retrieved, args.budget, mode=mode, preamble_for=preamble_for)
+            picked = [c for c in packed if c["content"] in score_by_content]
+            relevant = [c for c in picked if c["title"].lower().startswith(topic)]
+
+            totals["score"] += sum(score_by_content[c["content"]] for c in picked)
+            totals["tokens"] += used
+            totals["chunks"] += len(picked)
+            totals["relevant_chunks"] += len(relevant)
+            totals["distinct_relevant_chunks"] += len({token_handler._content_key(c) for c in relevant})
+
+        report[mode] = {name: round(value / len(EVAL_QUERIES), 3) for name, value in totals.items()}
+
+    report["settings"] = {"queries": len(EVAL_QUERIES), "chunks": len(chunks), "top_k": args.top_k, "budget": args.budget}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os, sys
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from utils.index_registry import INDEX_DEFAULTS, build_corpus_index, apply_search_params
+
+# Recall@k against exact search and per-query latency for each corpus index type, built
+# with the same code the registry uses. Vectors are clustered and L2-normalized like
+# embeddings; pass --vectors to use real ones (.npy).
+
+
+def synthetic_vectors(rng: np.random.Generator, n: int, dimension: int, clusters: int) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dimension)).astype("float32")
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dimension)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, truth: np.ndarray) -> dict:
+    latencies = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        _distances, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return {
+        "recall_at_k": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report recall and latency per index type.")
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--vectors", help="Optional .npy file of corpus vectors.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.vectors:
+        vectors = np.load(args.vectors).astype("float32")
+        faiss.normalize_L2(vectors)
+    else:
+        vectors = synthetic_vectors(rng, args.size, args.dimension, args.clusters)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)] \
+        + 0.05 * rng.standard_normal((args.queries, vectors.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+    ids = np.arange(len(vectors), dtype="int64")
+
+    runs = [("flat", {})]
+    runs += [("ivf", {"ivf_nprobe": nprobe}) for nprobe in args.nprobe]
+    runs += [("hnsw", {"hnsw_ef_search": ef}) for ef in args.ef_search]
+
+    report = {"vectors": len(vectors), "dimension": int(vectors.shape[1]), "k": args.k, "results": []}
+    built = {}
+    truth = None
+    for index_type, search_params in runs:
+        settings = {**INDEX_DEFAULTS, "index_type": index_type, **search_params}
+        if index_type not in built:
+            started = time.perf_counter()
+            index = build_corpus_index(settings, vectors.shape[1], vectors)
+            index.add_with_ids(vectors, ids)
+            built[index_type] = (index, time.perf_counter() - started)
+        index, build_seconds = built[index_type]
+        apply_search_params(index, settings)
+
+        if truth is None:
+            truth = index.search(queries, args.k)[1]
+
+        result = {"index_type": index_type, **search_params, "build_seconds": round(build_seconds, 2)}
+        result.update(measure(index, queries, args.k, truth))
+        report["results"].append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
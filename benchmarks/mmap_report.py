@@ -0,0 +1,125 @@
+import os, sys
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+import faiss
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+# Compares in-memory and memory-mapped registry loading on a synthetic corpus: startup time,
+# anonymous vs file-backed RSS, and cold (page cache dropped) vs warm search latency. Each
+# mode runs in its own process so RSS is not polluted by the other.
+
+
+def memory_status() -> dict:
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                status[key] = round(int(value.split()[0]) / 1024, 1)
+    return status
+
+
+def evict_page_cache(directory: str) -> None:
+    for name in os.listdir(directory):
+        fd = os.open(os.path.join(directory, name), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def build_corpus(directory: str, files: int, vectors_per_file: int, dimension: int, seed: int) -> None:
+    from utils.chunk_store import chunk_table_path, write_chunk_table
+
+    rng = np.random.default_rng(seed)
+    for f in range(files):
+        vectors = rng.standard_normal((vectors_per_file, dimension)).astype("float32")
+        faiss.normalize_L2(vectors)
+        index = faiss.IndexFlatIP(dimension)
+        index.add(vectors)
+        faiss.write_index(index, os.path.join(directory, f"doc_{f}_index.index"))
+        write_chunk_table(
+            chunk_table_path(f"doc_{f}", directory),
+            [{"id": f"{f}-{i}", "title": f"Section {i}", "content": "text " * 150} for i in range(vectors_per_file)],
+        )
+
+
+def run_worker(directory: str, mmap: bool, queries: int, dimension: int, k: int) -> dict:
+    from utils.index_registry import IndexRegistry
+
+    rng = np.random.default_rng(1)
+    query_vectors = rng.standard_normal((queries + 1, dimension)).astype("float32")
+    faiss.normalize_L2(query_vectors)
+
+    evict_page_cache(directory)
+    baseline = memory_status()
+    started = time.perf_counter()
+    registry = IndexRegistry(index_dir=directory, chunks_dir=directory, refresh_interval=3600, mmap=mmap)
+    registry.refresh(force=True)
+    startup_seconds = time.perf_counter() - started
+    after_startup = memory_status()
+
+    evict_page_cache(directory)
+    started = time.perf_counter()
+    registry.search(query_vectors[:1], k)
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    for query in query_vectors[1:]:
+        started = time.perf_counter()
+        registry.search(query[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "mode": "mmap" if mmap else "in_memory",
+        "vectors": registry.vector_count,
+        "startup_seconds": round(startup_seconds, 3),
+        "rss_mb_baseline": baseline,
+        "rss_mb_after_startup": after_startup,
+        "rss_mb_after_search": memory_status(),
+        "cold_search_ms": round(cold_ms, 2),
+        "warm_search_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "warm_search_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report RSS and search latency for mmap vs in-memory indexes.")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--vectors-per-file", type=int, default=4000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dir", help="Reuse a corpus directory instead of generating one.")
+    parser.add_argument("--worker", choices=["mmap", "in_memory"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.dir, args.worker == "mmap", args.queries, args.dimension, args.k)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = args.dir or tmp_dir
+        if not args.dir:
+            build_corpus(directory, args.files, args.vectors_per_file, args.dimension, seed=0)
+
+        results = []
+        for mode in ("in_memory", "mmap"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", mode, "--dir", directory,
+                 "--queries", str(args.queries), "--dimension", str(args.dimension), "--k", str(args.k)],
+                check=True, capture_output=True, text=True, env={**os.environ, "LOG_TO_STDOUT": "false"},
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import os, sys
+import argparse
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import textwrap
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+# Times each ingestion and query stage on synthetic corpora against the stub OpenAI server,
+# so runs cost nothing and model latency is fixed. Every corpus size runs in its own process
+# with its own DATA_DIR. Save results with --output and pass an earlier file as --baseline to
+# compare p50 latencies across commits.
+
+STAGES = (
+    "extract_text_from_pdf", "chunk_text", "embed_chunks", "save_chunks_and_index",
+    "search_all_indexes", "build_prompt_within_limit", "trim_chat_history", "query_pipeline",
+)
+QUERIES = [
+    "I am having white rice with dinner",
+    "oatmeal porridge for breakfast",
+    "sourdough toast sandwich at lunch",
+    "spaghetti noodles tonight",
+    "a banana and some berries",
+    "greek yogurt with milk",
+    "lentils and chickpeas hummus",
+    "chocolate cake dessert",
+]
+
+
+def write_pdf(path: str, text: str) -> None:
+    import fitz
+
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 50
+    for paragraph in text.split("\n"):
+        for line in textwrap.wrap(paragraph, 90) or [""]:
+            if y > 780:
+                page = doc.new_page()
+                y = 50
+            page.insert_text((50, y), line, fontsize=9)
+            y += 12
+    doc.save(path)
+    doc.close()
+
+
+def summarize(samples: list) -> dict:
+    samples_ms = np.array(samples) * 1000
+    return {
+        "calls": len(samples),
+        "total_s": round(float(samples_ms.sum()) / 1000, 3),
+        "mean_ms": round(float(samples_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+    }
+
+
+def run_worker(pdfs: int, sections_per_topic: int, queries: int, seed: int) -> dict:
+    from benchmarks.context_packing_eval import synthetic_corpus
+    from app.config import FILES_DIR
+    from app.pipelines.query_pipeline import query_pipeline
+    from utils.config_handler import ConfigHandler
+    from utils.file_handler import FileHandler
+    from utils.index_registry import index_registry
+    from utils.token_handler import TokenHandler
+
+    config_handler = ConfigHandler()
+    config = config_handler.load_config()
+    # Measure the stages themselves, not the caches in front of them.
+    config.update({"embedding_cache_enabled": False, "query_cache_max_entries": 0, "response_cache_mode": "off"})
+    config_handler.save_config(config)
+
+    file_handler = FileHandler()
+    token_handler = TokenHandler()
+    rng = random.Random(seed)
+    for f, text in enumerate(synthetic_corpus(rng, pdfs, sections_per_topic)):
+        write_pdf(os.path.join(FILES_DIR, f"manual_{f}.pdf"), text)
+
+    samples = {stage: [] for stage in STAGES}
+
+    def timed(stage, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        samples[stage].append(time.perf_counter() - started)
+        return result
+
+    total_chunks = 0
+    for f in range(pdfs):
+        file_name = f"manual_{f}"
+        text = timed("extract_text_from_pdf", file_handler.extract_text_from_pdf, file_name)
+        chunks = timed("chunk_text", file_handler.chunk_text, text, file_name=file_name)
+        embeddings = timed("embed_chunks", file_handler.embed_chunks, chunks)
+        timed("save_chunks_and_index", file_handler.save_chunks_and_index, chunks, embeddings, file_name)
+        index_registry.load_file(file_name)
+        total_chunks += len(chunks)
+
+    chat_history = []
+    for turn in range(20):
+        chat_history.append({"role": "user", "content": QUERIES[turn % len(QUERIES)]})
+        chat_history.append({"role": "assistant", "content": " ".join(rng.choices(QUERIES, k=6))})
+
+    base_prompt = config.get("base_prompt")
+    for q in range(queries):
+        query = QUERIES[q % len(QUERIES)]
+        retrieved = timed("search_all_indexes", file_handler.search_all_indexes, query)
+        timed("build_prompt_within_limit", token_handler.build_prompt_within_limit,
+              base_prompt, query, retrieved, preamble_for=index_registry.preamble_for)
+        timed("trim_chat_history", token_handler.trim_chat_history, chat_history)
+        timed("query_pipeline", query_pipeline, query)
+
+    return {
+        "pdfs": pdfs,
+        "chunks": total_chunks,
+        "vectors": index_registry.vector_count,
+        "stages": {stage: summarize(values) for stage, values in samples.items() if values},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline: dict) -> list:
+    previous = {result["pdfs"]: result["stages"] for result in baseline["results"]}
+    rows = []
+    for result in report["results"]:
+        for stage, stats in result["stages"].items():
+            before = previous.get(result["pdfs"], {}).get(stage)
+            if before is None or not before["p50_ms"]:
+                continue
+            rows.append({
+                "pdfs": result["pdfs"],
+                "stage": stage,
+                "baseline_p50_ms": before["p50_ms"],
+                "p50_ms": stats["p50_ms"],
+                "ratio": round(stats["p50_ms"] / before["p50_ms"], 3),
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage against a stub OpenAI server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000], help="Corpus sizes in PDFs.")
+    parser.add_argument("--sections-per-topic", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--chat-latency-ms", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare p50 latencies against.")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.sections_per_topic, args.queries, args.seed)))
+        return
+
+    from benchmarks.stub_openai_server import start_server
+
+    server = start_server(
+        dimension=args.dimension,
+        embedding_latency_ms=args.embedding_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+    )
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {
+            "sections_per_topic": args.sections_per_topic,
+            "queries": args.queries,
+            "dimension": args.dimension,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "chat_latency_ms": args.chat_latency_ms,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    for pdfs in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = {**os.environ, "DATA_DIR": data_dir, "OPENAI_BASE_URL": base_url, "LOG_TO_STDOUT": "false"}
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", str(pdfs), "--sections-per-topic", str(args.sections_per_topic),
+                 "--queries", str(args.queries), "--seed", str(args.seed)],
+                check=True, capture_output=True, text=True, env=env,
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        report["results"].append(result)
+        print(json.dumps({"pdfs": pdfs, "chunks": result["chunks"]}), file=sys.stderr)
+
+    server.shutdown()
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["comparison"] = {"baseline_commit": baseline.get("commit"), "rows": compare(report, baseline)}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
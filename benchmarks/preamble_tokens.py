@@ -0,0 +1,92 @@
+import os, sys
+import argparse
+import json
+import random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from utils.file_handler import FileHandler
+from utils.token_handler import TokenHandler
+
+# Measures embedding and prompt tokens with the general rules copied into every chunk
+# (the previous chunk format) against storing them once per file as a preamble chunk.
+
+WORDS = "rice bread oats lentils chicken salmon yogurt spinach walk protein fiber vinegar cooled portion".split()
+
+
+def synthetic_text(rng: random.Random, sections: int, rules_words: int, section_words: int) -> str:
+    text = "Section: General rules\n" + " ".join(rng.choices(WORDS, k=rules_words)) + "\n"
+    for i in range(sections):
+        text += f"Section: Meal {i}\n" + " ".join(rng.choices(WORDS, k=section_words)) + "\n"
+    return text
+
+
+def inline_preamble(chunks: list) -> list:
+    preamble = next(chunk for chunk in chunks if chunk.get("preamble"))
+    rules = preamble["content"].split("\n", 3)[-1]
+    inlined = []
+    for chunk in chunks:
+        chunk = {k: v for k, v in chunk.items() if k not in ("tokens", "token_encoding")}
+        if chunk.pop("preamble", False):
+            inlined.append(chunk)
+            continue
+        header, body = chunk["content"].split("\n\n", 1)
+        inlined.append({**chunk, "content": f"{header}\n\n{rules}\n\n{body}", "file": None})
+    return inlined
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding and prompt tokens with and without preamble chunks.")
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--sections", type=int, default=40)
+    parser.add_argument("--rules-words", type=int, default=300)
+    parser.add_argument("--section-words", type=int, default=80)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    file_handler = FileHandler()
+    token_handler = TokenHandler()
+
+    new_chunks = []
+    for f in range(args.files):
+        text = synthetic_text(rng, args.sections, args.rules_words, args.section_words)
+        new_chunks.extend(file_handler.iter_chunks([text], file_name=f"manual_{f}"))
+    old_chunks = []
+    for f in range(args.files):
+        old_chunks.extend(inline_preamble([c for c in new_chunks if c["file"] == f"manual_{f}"]))
+
+    preambles = {chunk["file"]: chunk for chunk in new_chunks if chunk.get("preamble")}
+    preamble_for = lambda chunk: preambles.get(chunk.get("file"))
+
+    prompt_tokens = {"before": 0, "after": 0}
+    for _ in range(args.requests):
+        rows = rng.sample(range(len(new_chunks)), args.top_k)
+        for label, chunks, lookup in (("before", old_chunks, None), ("after", new_chunks, preamble_for)):
+            prompt, _query = token_handler.build_prompt_within_limit(
+                "base prompt", "what should I eat", [(chunks[row], 1.0) for row in rows], preamble_for=lookup
+            )
+            prompt_tokens[label] += token_handler.count_tokens(prompt)
+
+    report = {
+        "chunks": len(new_chunks),
+        "embedding_tokens": {
+            "before": sum(token_handler.count_tokens(c["content"]) for c in old_chunks),
+            "after": sum(token_handler.count_tokens(c["content"]) for c in new_chunks),
+        },
+        "chunk_table_bytes": {
+            "before": sum(len(json.dumps(c, ensure_ascii=False)) + 1 for c in old_chunks),
+            "after": sum(len(json.dumps(c, ensure_ascii=False)) + 1 for c in new_chunks),
+        },
+        "prompt_tokens_per_request": {
+            label: round(total / args.requests, 1) for label, total in prompt_tokens.items()
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal OpenAI-compatible server for exercising the app without API keys or spend.
+# Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1. Latency settings add a
+# fixed delay to every request, to approximate network and model time.
+
+
+def fake_embedding(text: str, dimension: int) -> list:
+    vector = np.zeros(dimension, dtype="float32")
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimension] += 1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    dimension = 1536
+    embedding_latency = 0.0
+    chat_latency = 0.0
+    stats = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, model: str, content: str, usage: dict = None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        if usage is not None:
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.stats_lock:
+                self._send_json(dict(self.stats))
+            return
+        self._send_json({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        payload = self._read_json()
+
+        if self.path.endswith("/embeddings"):
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            dimension = payload.get("dimensions") or self.dimension
+            input_tokens = sum(len(text.split()) for text in inputs)
+
+            with self.stats_lock:
+                self.stats["embedding_requests"] += 1
+                self.stats["embedding_inputs"] += len(inputs)
+            time.sleep(self.embedding_latency)
+
+            self._send_json({
+                "object": "list",
+                "model": payload.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimension)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": input_tokens, "total_tokens": input_tokens},
+            })
+            return
+
+        if self.path.endswith("/chat/completions"):
+            with self.stats_lock:
+                self.stats["chat_requests"] += 1
+            time.sleep(self.chat_latency)
+
+            # One-token calls are the classifiers: answer "new food" / "type A".
+            if payload.get("max_tokens") == 1:
+                system_prompt = payload["messages"][0]["content"]
+                content = "0" if "Classify the user input" in system_prompt else "A"
+            else:
+                content = "Stub answer for: " + payload["messages"][-1]["content"][:200]
+
+            # Word counts stand in for token counts.
+            prompt_tokens = sum(len(message["content"].split()) for message in payload["messages"])
+            completion_tokens = len(content.split())
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+
+            if payload.get("stream"):
+                include_usage = (payload.get("stream_options") or {}).get("include_usage")
+                self._send_stream(payload.get("model"), content, usage if include_usage else None)
+                return
+
+            self._send_json({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self._send_json({"error": {"message": "not found"}}, status=404)
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, dimension: int = 1536,
+                 embedding_latency_ms: float = 0, chat_latency_ms: float = 0) -> ThreadingHTTPServer:
+    StubOpenAIHandler.dimension = dimension
+    StubOpenAIHandler.embedding_latency = embedding_latency_ms / 1000
+    StubOpenAIHandler.chat_latency = chat_latency_ms / 1000
+    server = ThreadingHTTPServer((host, port), StubOpenAIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    StubOpenAIHandler.dimension = args.dimension
+    StubOpenAIHandler.embedding_latency = args.embedding_latency_ms / 1000
+    StubOpenAIHandler.chat_latency = args.chat_latency_ms / 1000
+    server = ThreadingHTTPServer((args.host, args.port), StubOpenAIHandler)
+    print(f"Stub OpenAI server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
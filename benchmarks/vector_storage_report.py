@@ -0,0 +1,86 @@
+import os, sys
+import argparse
+import json
+import tempfile
+import faiss
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from utils.index_registry import build_flat_index
+from benchmarks.index_report import synthetic_vectors
+
+# Recall@k against exact float32 search, bytes per vector and on-disk index size for each
+# vector_storage option, plus shortened (truncated and renormalized) embeddings, which is
+# what the embeddings API returns for `dimensions`. Pass --vectors to use real ones (.npy).
+
+
+def index_file_bytes(index: faiss.Index) -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "index.index")
+        faiss.write_index(index, path)
+        return os.path.getsize(path)
+
+
+def recall(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    return round(float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report recall and size per vector storage option.")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--vectors", help="Optional .npy file of corpus vectors.")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1024, 512, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.vectors:
+        vectors = np.load(args.vectors).astype("float32")
+        faiss.normalize_L2(vectors)
+    else:
+        vectors = synthetic_vectors(rng, args.size, args.dimension, args.clusters)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)] \
+        + 0.05 * rng.standard_normal((args.queries, vectors.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+
+    full_dimension = int(vectors.shape[1])
+    runs = [(storage, full_dimension) for storage in ("float32", "float16", "sq8")]
+    runs += [("float32", d) for d in args.dimensions if d < full_dimension]
+
+    report = {"vectors": len(vectors), "dimension": full_dimension, "k": args.k, "results": []}
+    truth = None
+    for storage, dimension in runs:
+        corpus = np.ascontiguousarray(vectors[:, :dimension])
+        probes = np.ascontiguousarray(queries[:, :dimension])
+        if dimension < full_dimension:
+            faiss.normalize_L2(corpus)
+            faiss.normalize_L2(probes)
+
+        index = build_flat_index(dimension, storage, corpus)
+        index.add(corpus)
+        found = index.search(probes, args.k)[1]
+        if truth is None:
+            truth = found
+
+        file_bytes = index_file_bytes(index)
+        result = {
+            "vector_storage": storage,
+            "dimension": dimension,
+            "recall_at_k": recall(found, truth, args.k),
+            "bytes_per_vector": round(file_bytes / len(corpus), 1),
+            "index_file_mb": round(file_bytes / (1024 * 1024), 2),
+        }
+        report["results"].append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os, sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Everything runs against the stub OpenAI server and a throwaway DATA_DIR. These have to be
+# set before any app module is imported, since app.config reads them at import time.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="meal-assistant-tests-")
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["LOG_TO_STDOUT"] = "false"
+
+from benchmarks.stub_openai_server import StubOpenAIHandler, start_server
+
+STUB_DIMENSION = 64
+stub_server = start_server(dimension=STUB_DIMENSION)
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{stub_server.server_port}/v1"
+
+from utils.config_handler import ConfigHandler
+
+
+@pytest.fixture
+def config():
+    # Applies config overrides for one test and restores the original afterwards.
+    handler = ConfigHandler()
+    original = handler.load_config()
+
+    def update(**overrides):
+        handler.save_config({**original, **overrides})
+
+    yield update
+    handler.save_config(original)
+
+
+@pytest.fixture
+def stub_stats():
+    # Returns a function giving the stub's counters relative to the start of the test.
+    with StubOpenAIHandler.stats_lock:
+        start = dict(StubOpenAIHandler.stats)
+
+    def delta():
+        with StubOpenAIHandler.stats_lock:
+            return {key: value - start[key] for key, value in StubOpenAIHandler.stats.items()}
+
+    return delta
@@ -0,0 +1,107 @@
+from uuid import uuid4
+import numpy as np
+import pytest
+
+from benchmarks.stub_openai_server import fake_embedding
+from app.api.openai_client import embed_texts
+from utils.token_handler import TokenHandler
+from conftest import STUB_DIMENSION
+
+
+def unique_texts(count: int, words: int = 5) -> list:
+    # Fresh words per test keep the persistent embedding cache from serving earlier runs.
+    prefix = uuid4().hex[:8]
+    return [" ".join(f"{prefix}w{i}x{j}" for j in range(words)) for i in range(count)]
+
+
+def assert_vectors_match(texts, vectors):
+    assert len(vectors) == len(texts)
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, fake_embedding(text, STUB_DIMENSION), rtol=1e-6, atol=1e-7)
+
+
+def test_batches_split_by_input_count(config, stub_stats):
+    config(embedding_cache_enabled=False, embedding_batch_max_inputs=3)
+    texts = unique_texts(7)
+
+    vectors = embed_texts(texts)
+
+    assert stub_stats()["embedding_requests"] == 3
+    assert stub_stats()["embedding_inputs"] == 7
+    assert_vectors_match(texts, vectors)
+
+
+def test_batches_split_by_tokens(config, stub_stats):
+    texts = unique_texts(6, words=10)
+    per_text = max(TokenHandler().count_tokens(text) for text in texts)
+    # Room for two texts per request, well under the input limit.
+    config(embedding_cache_enabled=False, embedding_batch_max_inputs=100, embedding_batch_max_tokens=2 * per_text)
+
+    vectors = embed_texts(texts)
+
+    assert stub_stats()["embedding_requests"] == 3
+    assert_vectors_match(texts, vectors)
+
+
+def test_oversized_text_gets_its_own_batch(config, stub_stats):
+    texts = unique_texts(3, words=4)
+    long_text = unique_texts(1, words=200)[0]
+    config(
+        embedding_cache_enabled=False,
+        embedding_batch_max_inputs=100,
+        embedding_batch_max_tokens=TokenHandler().count_tokens(long_text) // 2,
+    )
+
+    vectors = embed_texts([texts[0], long_text, texts[1], texts[2]])
+
+    assert stub_stats()["embedding_requests"] == 3
+    assert_vectors_match([texts[0], long_text, texts[1], texts[2]], vectors)
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_results_keep_input_order(config, stub_stats, concurrency):
+    config(embedding_cache_enabled=False, embedding_batch_max_inputs=2, embedding_concurrency=concurrency)
+    texts = unique_texts(9)
+    # Repeated texts are sent once but still fill every position they appear in.
+    requested = texts + texts[:3]
+
+    vectors = embed_texts(requested)
+
+    assert stub_stats()["embedding_inputs"] == 9
+    assert_vectors_match(requested, vectors)
+
+
+def test_cache_hits_skip_the_api(config, stub_stats):
+    config(embedding_cache_enabled=True, embedding_batch_max_inputs=4)
+    texts = unique_texts(6)
+
+    first = embed_texts(texts)
+    assert stub_stats()["embedding_inputs"] == 6
+
+    second = embed_texts(texts)
+    assert stub_stats()["embedding_inputs"] == 6
+    np.testing.assert_allclose(second, first)
+
+
+def test_only_cache_misses_are_requested(config, stub_stats):
+    config(embedding_cache_enabled=True, embedding_batch_max_inputs=4)
+    cached, fresh = unique_texts(4), unique_texts(3)
+    embed_texts(cached)
+
+    requested = [fresh[0], cached[1], fresh[1], cached[3], fresh[2]]
+    vectors = embed_texts(requested)
+
+    assert stub_stats()["embedding_inputs"] == 4 + 3
+    assert_vectors_match(requested, vectors)
+
+
+def test_cache_is_keyed_by_shortened_dimensions(config, stub_stats):
+    config(embedding_cache_enabled=True, embedding_dimensions=None)
+    texts = unique_texts(2)
+    embed_texts(texts)
+
+    config(embedding_cache_enabled=True, embedding_dimensions=16)
+    vectors = embed_texts(texts)
+
+    assert stub_stats()["embedding_inputs"] == 4
+    assert all(len(vector) == 16 for vector in vectors)
@@ -0,0 +1,150 @@
+import os
+from uuid import uuid4
+import faiss
+import fitz
+import numpy as np
+import pytest
+
+from benchmarks.stub_openai_server import fake_embedding
+from app.config import FILES_DIR
+from app.pipelines.file_pipeline import file_upload_pipeline, file_update_pipeline, file_delete_pipeline
+from utils.chunk_store import chunk_table_path, read_chunk_table
+from utils.index_registry import index_registry
+from conftest import STUB_DIMENSION
+
+
+@pytest.fixture(autouse=True)
+def empty_corpus(config):
+    config(embedding_cache_enabled=False)
+    yield config
+    for name in os.listdir(FILES_DIR):
+        if name.endswith(".pdf"):
+            os.remove(os.path.join(FILES_DIR, name))
+            file_delete_pipeline(name[:-len(".pdf")])
+
+
+def sections(count: int) -> list:
+    # Every section uses its own words, so each chunk's nearest vector is its own.
+    prefix = uuid4().hex[:8]
+    return [(f"Part {prefix} {i}", f"{prefix}body{i} {prefix}extra{i} {prefix}more{i}") for i in range(count)]
+
+
+def write_pdf(file_name: str, parts: list) -> None:
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 50
+    for title, body in [("General rules", "Always pair carbs with protein.")] + parts:
+        for line in (f"Section: {title}", body):
+            if y > 780:
+                page = doc.new_page()
+                y = 50
+            page.insert_text((50, y), line)
+            y += 14
+    doc.save(os.path.join(FILES_DIR, f"{file_name}.pdf"))
+    doc.close()
+
+
+def upload(file_name: str, parts: list) -> None:
+    write_pdf(file_name, parts)
+    file_upload_pipeline(file_name)
+
+
+def update(file_name: str, parts: list) -> None:
+    write_pdf(file_name, parts)
+    file_update_pipeline(file_name)
+
+
+def delete(file_name: str) -> None:
+    os.remove(os.path.join(FILES_DIR, f"{file_name}.pdf"))
+    file_delete_pipeline(file_name)
+
+
+def live_chunks(file_name: str) -> list:
+    return [chunk for chunk in read_chunk_table(chunk_table_path(file_name)) if not chunk.get("deleted")]
+
+
+def top_hit(chunk: dict):
+    query = np.array([fake_embedding(chunk["content"], STUB_DIMENSION)], dtype="float32")
+    faiss.normalize_L2(query)
+    results = index_registry.search(query, 1)
+    return results[0] if results else (None, 0.0)
+
+
+def assert_corpus_maps(file_names: list) -> None:
+    # Every live chunk must come back for its own vector, and nothing else may be indexed.
+    expected = [chunk for file_name in file_names for chunk in live_chunks(file_name)]
+    for chunk in expected:
+        hit, score = top_hit(chunk)
+        assert hit is not None and hit["id"] == chunk["id"] and hit["file"] == chunk["file"]
+        assert score == pytest.approx(1.0, abs=1e-3)
+    assert index_registry.vector_count == len(expected)
+
+
+@pytest.fixture(params=["flat", "ivf", "hnsw"])
+def index_type(request, empty_corpus):
+    empty_corpus(embedding_cache_enabled=False, index_type=request.param)
+    return request.param
+
+
+def test_files_map_to_their_own_chunks(index_type):
+    upload("first", sections(4))
+    upload("second", sections(3))
+
+    assert_corpus_maps(["first", "second"])
+
+
+def test_diff_tombstones_removed_sections_and_appends_new_ones(index_type):
+    parts = sections(6)
+    upload("menu", parts)
+    upload("other", sections(3))
+    # Row 0 is the general rules preamble, so row 3 holds parts[2].
+    removed = live_chunks("menu")[3]
+
+    changed = parts[:2] + [(parts[3][0], parts[3][1] + " revised")] + parts[4:] + sections(1)
+    update("menu", changed)
+
+    table = read_chunk_table(chunk_table_path("menu"))
+    # Two sections went away, so their rows are tombstoned in place rather than compacted.
+    assert sum(1 for chunk in table if chunk.get("deleted")) == 2
+    assert removed["id"] not in {chunk["id"] for chunk in live_chunks("menu")}
+    hit, _ = top_hit(removed)
+    assert hit is None or hit["id"] != removed["id"]
+    assert_corpus_maps(["menu", "other"])
+
+
+def test_unchanged_update_keeps_rows(index_type):
+    parts = sections(4)
+    upload("menu", parts)
+    before = read_chunk_table(chunk_table_path("menu"))
+
+    update("menu", parts)
+
+    assert read_chunk_table(chunk_table_path("menu")) == before
+    assert_corpus_maps(["menu"])
+
+
+def test_compaction_drops_tombstones_and_keeps_mapping(index_type):
+    parts = sections(8)
+    upload("menu", parts)
+    upload("other", sections(2))
+
+    update("menu", parts[:1] + sections(1))
+
+    table = read_chunk_table(chunk_table_path("menu"))
+    assert not any(chunk.get("deleted") for chunk in table)
+    assert len(table) == 3
+    assert_corpus_maps(["menu", "other"])
+
+
+def test_deleted_file_slot_is_reused(index_type):
+    upload("first", sections(3))
+    upload("second", sections(3))
+    first_chunks = live_chunks("first")
+
+    delete("first")
+    upload("third", sections(4))
+
+    for chunk in first_chunks:
+        hit, _ = top_hit(chunk)
+        assert hit is None or hit["file"] != "first"
+    assert_corpus_maps(["second", "third"])
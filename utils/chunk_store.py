@@ -0,0 +1,138 @@
+import os, sys
+import json
+import mmap
+import numpy as np
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.logger import log_event
+from app.config import CHUNKS_DIR
+
+# Chunk tables are JSON Lines: line i holds the chunk stored at row i of the file's FAISS index.
+# A sidecar row index ({file}_chunks_rows.npy) holds each line's byte offset and flags, so a
+# memory-mapped table can decode single rows without parsing the whole file.
+
+ROW_DELETED = 1
+ROW_PREAMBLE = 2
+
+
+def chunk_table_path(file_name: str, chunks_dir: str = CHUNKS_DIR) -> str:
+    return os.path.join(chunks_dir, f"{file_name}_chunks.jsonl")
+
+
+def legacy_chunk_table_path(file_name: str, chunks_dir: str = CHUNKS_DIR) -> str:
+    return os.path.join(chunks_dir, f"{file_name}_chunks.json")
+
+
+def chunk_rows_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}_rows.npy"
+
+
+def _row_flags(chunk: Dict) -> int:
+    return (ROW_DELETED if chunk.get("deleted") else 0) | (ROW_PREAMBLE if chunk.get("preamble") else 0)
+
+
+def _write_row_index(path: str, rows: List[List[int]]) -> None:
+    # Rows are (offset, flags); a final (file size, 0) row closes the last line.
+    rows_path = chunk_rows_path(path)
+    tmp_path = f"{rows_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.array(rows, dtype="int64").reshape(-1, 2))
+    os.replace(tmp_path, rows_path)
+
+
+def write_chunk_table(path: str, chunks: List[Dict]) -> None:
+    tmp_path = f"{path}.tmp"
+    rows = []
+    offset = 0
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            line = json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n"
+            rows.append([offset, _row_flags(chunk)])
+            f.write(line)
+            offset += len(line)
+    rows.append([offset, 0])
+    os.replace(tmp_path, path)
+    _write_row_index(path, rows)
+
+
+def build_row_index(path: str) -> None:
+    # For tables written before row indexes existed.
+    rows = []
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                rows.append([offset, _row_flags(json.loads(line))])
+            offset += len(line)
+    rows.append([offset, 0])
+    _write_row_index(path, rows)
+    log_event("SUCCESS", f"Built row index for {os.path.basename(path)}.")
+
+
+class MappedChunkTable:
+    def __init__(self, path: str):
+        rows_path = chunk_rows_path(path)
+        if not os.path.exists(rows_path):
+            build_row_index(path)
+
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._rows = np.load(rows_path, mmap_mode="r")
+            size = os.fstat(self._file.fileno()).st_size
+            if int(self._rows[-1][0]) != size:
+                raise ValueError(f"Row index for {os.path.basename(path)} is stale ({size} bytes on disk).")
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        except Exception:
+            self._file.close()
+            raise
+
+    def __len__(self) -> int:
+        return len(self._rows) - 1
+
+    def __getitem__(self, row: int) -> Dict:
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        start, end = int(self._rows[row][0]), int(self._rows[row + 1][0])
+        return json.loads(self._data[start:end])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def deleted_rows(self) -> np.ndarray:
+        return np.flatnonzero(self._rows[:-1, 1] & ROW_DELETED)
+
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero((self._rows[:-1, 1] & ROW_DELETED) == 0)
+
+    def preamble(self) -> Optional[Dict]:
+        flags = self._rows[:-1, 1]
+        rows = np.flatnonzero(((flags & ROW_PREAMBLE) != 0) & ((flags & ROW_DELETED) == 0))
+        return self[int(rows[0])] if len(rows) else None
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+def read_chunk_table(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def migrate_legacy_chunk_table(file_name: str, chunks_dir: str = CHUNKS_DIR) -> None:
+    legacy_path = legacy_chunk_table_path(file_name, chunks_dir)
+    path = chunk_table_path(file_name, chunks_dir)
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return
+
+    # The legacy {id: chunk} dict was written in index row order, which json.load preserves.
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        chunk_data = json.load(f)
+    write_chunk_table(path, list(chunk_data.values()))
+    os.remove(legacy_path)
+    log_event("SUCCESS", f"Migrated chunk table for {file_name} to {os.path.basename(path)}.")
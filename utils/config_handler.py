@@ -1,5 +1,7 @@
 import json
 import os, sys
+import threading
+from typing import Callable, List
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -13,8 +15,28 @@ default_config = {
     "token_limit": 8000,
     "follow_ups_prompt": "You are a helpful assistant answering a follow up question...",
     "type_d_limit": False,
-    "follow_ups_limit": True
-    
+    "follow_ups_limit": True,
+    "embedding_batch_max_tokens": 100000,
+    "embedding_batch_max_inputs": 256,
+    "embedding_concurrency": 4,
+    "embedding_cache_enabled": True,
+    "embedding_cache_max_mb": 256,
+    "query_cache_max_entries": 1024,
+    "query_cache_ttl_seconds": 3600,
+    "response_cache_mode": "off",
+    "response_cache_ttl_seconds": 86400,
+    "response_cache_max_entries": 1000,
+    "response_cache_similarity_threshold": 0.95,
+    "speculative_execution": False,
+    "context_packing": "greedy",
+    "index_type": "flat",
+    "ivf_nlist": 1024,
+    "ivf_nprobe": 16,
+    "hnsw_m": 32,
+    "hnsw_ef_construction": 200,
+    "hnsw_ef_search": 64,
+    "vector_storage": "float32",
+    "embedding_dimensions": None
 }
 
 
@@ -23,17 +45,64 @@ if not os.path.exists(CONFIG_PATH):
     with open(CONFIG_PATH, 'w') as f:
         json.dump(default_config, f, indent=4)
 
+# Parsed config snapshots shared by every ConfigHandler in the process, keyed by path.
+_snapshots = {}
+_listeners: List[Callable[[dict], None]] = []
+_lock = threading.Lock()
+
+
 class ConfigHandler:
     def __init__(self, path=CONFIG_PATH):
         self.path = path
 
-    def load_config(self):
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _set_snapshot(self, config: dict, signature) -> dict:
+        with _lock:
+            previous = _snapshots.get(self.path)
+            snapshot = {
+                "config": config,
+                "signature": signature,
+                "version": previous["version"] + 1 if previous else 1,
+            }
+            _snapshots[self.path] = snapshot
+            listeners = list(_listeners)
+
+        if previous is not None:
+            for listener in listeners:
+                listener(dict(config))
+        return snapshot
+
+    def _snapshot(self) -> dict:
+        signature = self._file_signature()
+        snapshot = _snapshots.get(self.path)
+        if snapshot is not None and snapshot["signature"] == signature:
+            return snapshot
+
         with open(self.path, 'r') as f:
-            return json.load(f)
+            config = json.load(f)
+        return self._set_snapshot(config, signature)
+
+    @property
+    def version(self) -> int:
+        return self._snapshot()["version"]
+
+    @staticmethod
+    def subscribe(listener: Callable[[dict], None]) -> None:
+        with _lock:
+            _listeners.append(listener)
+
+    def load_config(self):
+        return dict(self._snapshot()["config"])
 
     def save_config(self, config_data: dict):
-        with open(self.path, 'w') as f:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(config_data, f, indent=4)
+        os.replace(tmp_path, self.path)
+        self._set_snapshot(dict(config_data), self._file_signature())
 
     def update_config(self, updates: dict):
         config = self.load_config()
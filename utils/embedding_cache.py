@@ -0,0 +1,130 @@
+import os, sys
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.logger import log_event
+from app.config import EMBEDDING_CACHE_PATH
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit.
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return [
+            np.frombuffer(found[key], dtype="float32").tolist() if key in found else None
+            for key in keys
+        ]
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]], max_bytes: int) -> None:
+        now = time.time()
+        rows = [
+            (self.make_key(model, text), model, np.asarray(vector, dtype="float32").tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+
+        with self._lock:
+            for key, _model, blob, _now in rows:
+                previous = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                self._size_bytes += len(blob) - (previous[0] if previous else 0)
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(max_bytes)
+            self._conn.commit()
+
+    def put(self, model: str, text: str, vector: List[float], max_bytes: int) -> None:
+        self.put_many(model, [text], [vector], max_bytes)
+
+    def _evict(self, max_bytes: int) -> None:
+        evicted = 0
+        while self._size_bytes > max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._size_bytes = 0
+                break
+
+            stale_keys = []
+            for key, size in rows:
+                if self._size_bytes <= max_bytes:
+                    break
+                stale_keys.append((key,))
+                self._size_bytes -= size
+
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", stale_keys)
+            evicted += len(stale_keys)
+
+        if evicted:
+            self.evictions += evicted
+            log_event("INFO", f"Embedding cache evicted {evicted} least recently used entries.")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": self._size_bytes,
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -1,76 +1,161 @@
 import os, sys
-import json
-import fitz  
+import asyncio
+import threading
 import faiss
 import numpy as np
-from uuid import uuid4
-from typing import List, Tuple, Dict
+import hashlib
+from typing import Callable, List, Tuple, Dict, Optional, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.api.openai_client import embed_text
+from app.api.openai_client import embed_text, aembed_text, embed_texts, embedding_settings
 from utils.config_handler import ConfigHandler
+from utils.token_handler import TokenHandler
 from utils.logger import log_event
+from utils.metrics import query_stage_seconds
+from utils.index_registry import index_registry, build_file_index
+from utils.cache_handler import TTLCache
+from utils.chunk_store import chunk_table_path, chunk_rows_path, legacy_chunk_table_path, write_chunk_table, read_chunk_table
+from utils.pdf_extractor import iter_page_texts
 
-from app.config import FILES_DIR, CHUNKS_DIR, INDEX_DIR
+from app.config import FILES_DIR, INDEX_DIR, PDF_EXTRACTION_WORKERS, PDF_PAGES_PER_TASK
+
+SECTION_MARKER = "Section: "
+# Share of tombstoned rows above which an update rewrites the file without them.
+TOMBSTONE_COMPACT_RATIO = 0.5
+
+query_vector_cache = TTLCache()
+token_handler = TokenHandler()
+
+
+def write_index(index: faiss.Index, index_path: str) -> None:
+    # Replace rather than overwrite: readers may have the old file memory-mapped.
+    tmp_path = f"{index_path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
 
 
 class FileHandler:
     def __init__(self):
-        config = ConfigHandler().load_config()
-        self.TOP_K_RESULTS = config.get("top_k_results")
-        self.SIMILARITY_THRESHOLD = config.get("similarity_threshold", 0.6)
+        self.config_handler = ConfigHandler()
 
+    @property
+    def TOP_K_RESULTS(self) -> int:
+        return self.config_handler.load_config().get("top_k_results")
 
-    def extract_text_from_pdf(self, file_name: str) -> str:
-        file_path = os.path.join(FILES_DIR, f"{file_name}.pdf")
-        full_text = ""
-        with fitz.open(file_path) as doc:
-            for page in doc:
-                full_text += page.get_text()
-        return full_text
+    @property
+    def SIMILARITY_THRESHOLD(self) -> float:
+        return self.config_handler.load_config().get("similarity_threshold", 0.6)
 
+    @property
+    def VECTOR_STORAGE(self) -> str:
+        return self.config_handler.load_config().get("vector_storage", "float32")
 
-    def chunk_text(self, full_text: str, file_name: str) -> List[Dict]:
-        sections = full_text.split("Section: ")
-        if len(sections) < 2:
-            raise ValueError("Expected 'Section: ' markers not found in PDF text.")
 
-        chunks = []
+    def iter_pdf_text(self, file_name: str) -> Iterator[str]:
+        file_path = os.path.join(FILES_DIR, f"{file_name}.pdf")
+        return iter_page_texts(file_path, workers=PDF_EXTRACTION_WORKERS, pages_per_task=PDF_PAGES_PER_TASK)
+
 
-        first_section = sections[1]
-        title_end = first_section.find("\n")
-        general_title = first_section[:title_end].strip()
-        general_rules = first_section[title_end + 1:].strip()
+    def extract_text_from_pdf(self, file_name: str) -> str:
+        return "".join(self.iter_pdf_text(file_name))
+
+
+    @staticmethod
+    def _stable_id(content: str, seen_ids: Dict[str, int]) -> str:
+        # Ids follow the section content, so an unchanged section keeps its id across
+        # re-uploads; repeated identical sections are told apart by occurrence.
+        section_id = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+        occurrence = seen_ids.get(section_id, 0)
+        seen_ids[section_id] = occurrence + 1
+        return section_id if occurrence == 0 else f"{section_id}-{occurrence}"
+
+
+    @staticmethod
+    def _split_section(section: str) -> Tuple[str, str]:
+        title_end = section.find("\n")
+        return section[:title_end].strip(), section[title_end + 1:].strip()
+
+
+    def iter_chunks(self, texts: Iterable[str], file_name: str) -> Iterator[Dict]:
+        # Emits each section as soon as the next marker shows up, so callers can start
+        # embedding while later pages are still being extracted.
+        buffer = ""
+        seen_marker = False
+        general_rules = None
+        seen_ids = {}
+
+        def make_chunk(section: str) -> Dict:
+            nonlocal general_rules
+            title, content = self._split_section(section)
+            full_chunk = f"from file: {file_name}.pdf\n\n## {title}\n{content}"
+            chunk = {"id": self._stable_id(full_chunk, seen_ids), "title": title, "content": full_chunk, "file": file_name}
+            # The general rules are stored once, as the file's preamble chunk, instead of
+            # being copied into every section; prompts pull them in once per file.
+            if general_rules is None:
+                general_rules = content
+                chunk["preamble"] = True
+            token_handler.chunk_tokens(chunk)
+            return chunk
+
+        for text in texts:
+            buffer += text
+            sections = buffer.split(SECTION_MARKER)
+            if not seen_marker:
+                if len(sections) < 2:
+                    # Keep a tail long enough to complete a marker split across pages.
+                    buffer = buffer[-(len(SECTION_MARKER) - 1):]
+                    continue
+                seen_marker = True
+                sections = sections[1:]
 
-        general_chunk = f"from file: {file_name}.pdf\n\n## {general_title}\n{general_rules}"
-        chunks.append({
-            "id": str(uuid4()),
-            "title": general_title,
-            "content": general_chunk
-        })
+            for section in sections[:-1]:
+                yield make_chunk(section)
+            buffer = sections[-1]
 
-        for section in sections[2:]:
-            title_end = section.find("\n")
-            title = section[:title_end].strip()
-            content = section[title_end + 1:].strip()
+        if not seen_marker:
+            raise ValueError("Expected 'Section: ' markers not found in PDF text.")
+        yield make_chunk(buffer)
 
-            full_chunk = f"from file: {file_name}.pdf\n\n{general_rules}\n\n## {title}\n{content}"
-            chunks.append({
-                "id": str(uuid4()),
-                "title": title,
-                "content": full_chunk
-            })
 
-        return chunks
+    def chunk_text(self, full_text: str, file_name: str) -> List[Dict]:
+        return list(self.iter_chunks([full_text], file_name))
 
 
     def embed_chunks(self, chunks: List[Dict]) -> List[Tuple[str, List[float]]]:
-        embeddings = []
-        for chunk in chunks:
-            vector = embed_text(chunk["content"])
-            embeddings.append((chunk["id"], vector))
-        return embeddings
+        vectors = embed_texts([chunk["content"] for chunk in chunks])
+        return [(chunk["id"], vector) for chunk, vector in zip(chunks, vectors)]
+
+
+    def embed_chunk_stream(self, chunks: Iterable[Dict], batch_size: int, concurrency: int = 1,
+                           progress: Optional[Callable] = None) -> Tuple[List[Dict], List[Tuple[str, List[float]]]]:
+        # Embeds full batches in the background, up to `concurrency` at a time, while the chunk
+        # iterator keeps producing. progress("embedding", ...) is reported after each batch.
+        collected, batch, futures = [], [], []
+        embedded = [0]
+        progress_lock = threading.Lock()
+
+        def embed_batch(batch: List[Dict]) -> List[Tuple[str, List[float]]]:
+            embeddings = self.embed_chunks(batch)
+            if progress is not None:
+                with progress_lock:
+                    embedded[0] += len(batch)
+                    progress("embedding", chunks=len(collected), embedded=embedded[0])
+            return embeddings
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="embedding") as embedder:
+            for chunk in chunks:
+                collected.append(chunk)
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    futures.append(embedder.submit(embed_batch, batch))
+                    batch = []
+            if batch:
+                futures.append(embedder.submit(embed_batch, batch))
+
+            embeddings = [item for future in futures for item in future.result()]
+        return collected, embeddings
 
 
     def save_chunks_and_index(self, chunks: List[Dict], embeddings: List[Tuple[str, List[float]]], file_name: str) -> None:
@@ -79,143 +164,199 @@ class FileHandler:
 
         dimension = len(vectors[0])
         
-        index = faiss.IndexFlatIP(dimension)
-        
         vectors_np = np.array(vectors).astype("float32")
         faiss.normalize_L2(vectors_np)
         
+        index = build_file_index(dimension, self.VECTOR_STORAGE)
         index.add(vectors_np)
 
         index_path = os.path.join(INDEX_DIR, f"{file_name}_index.index")
-        faiss.write_index(index, index_path)
+        write_index(index, index_path)
 
-        chunk_path = os.path.join(CHUNKS_DIR, f"{file_name}_chunks.json")
-        chunk_data = {chunk["id"]: chunk for chunk in chunks}
-        with open(chunk_path, "w", encoding="utf-8") as f:
-            json.dump(chunk_data, f, indent=2, ensure_ascii=False)
+        write_chunk_table(chunk_table_path(file_name), chunks)
 
 
-    def delete_data_files(self, file_name: str) -> None:
+    def diff_chunks(self, file_name: str, new_chunks: List[Dict]) -> Tuple[List[Dict], List[int]]:
+        # Stored ids are recomputed from content so tables written with random ids diff too.
+        stored_chunks = read_chunk_table(chunk_table_path(file_name))
+        seen_ids = {}
+        live_rows = {
+            self._stable_id(chunk["content"], seen_ids): row
+            for row, chunk in enumerate(stored_chunks)
+            if not chunk.get("deleted")
+        }
+        new_ids = {chunk["id"] for chunk in new_chunks}
+
+        added = [chunk for chunk in new_chunks if chunk["id"] not in live_rows]
+        removed_rows = sorted(row for section_id, row in live_rows.items() if section_id not in new_ids)
+        return added, removed_rows
+
+
+    def apply_chunk_diff(self, file_name: str, added: List[Dict], embeddings: List[Tuple[str, List[float]]],
+                         removed_rows: List[int]) -> Tuple[List[Dict], int, np.ndarray]:
+        # Removed rows become tombstones and new sections are appended, so every surviving
+        # row keeps its position (and its vector) in the file's index.
         index_path = os.path.join(INDEX_DIR, f"{file_name}_index.index")
-        chunk_path = os.path.join(CHUNKS_DIR, f"{file_name}_chunks.json")
+        chunk_path = chunk_table_path(file_name)
+        index = faiss.read_index(index_path)
+        chunks = read_chunk_table(chunk_path)
+
+        for row in removed_rows:
+            chunks[row] = {"id": chunks[row]["id"], "deleted": True}
+
+        first_row = len(chunks)
+        if embeddings and len(embeddings[0][1]) != index.d:
+            raise ValueError(
+                f"Embedding dimension {len(embeddings[0][1])} does not match the {file_name} index ({index.d}); "
+                f"delete and re-upload the file."
+            )
+        vectors_np = np.array([vec for _, vec in embeddings], dtype="float32").reshape(len(embeddings), index.d)
+        if len(vectors_np):
+            faiss.normalize_L2(vectors_np)
+            index.add(vectors_np)
+        chunks.extend(added)
+
+        write_index(index, index_path)
+        write_chunk_table(chunk_path, chunks)
+        return chunks, first_row, vectors_np
+
+
+    def compact_chunks_and_index(self, file_name: str) -> bool:
+        index_path = os.path.join(INDEX_DIR, f"{file_name}_index.index")
+        chunk_path = chunk_table_path(file_name)
+        chunks = read_chunk_table(chunk_path)
+        live_rows = [row for row, chunk in enumerate(chunks) if not chunk.get("deleted")]
+        if len(chunks) - len(live_rows) <= len(chunks) * TOMBSTONE_COMPACT_RATIO:
+            return False
 
-        for path in [index_path, chunk_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        index = faiss.read_index(index_path)
+        vectors_np = index.reconstruct_n(0, index.ntotal)[live_rows]
+        compacted = build_file_index(index.d, self.VECTOR_STORAGE)
+        compacted.add(vectors_np)
 
+        write_index(compacted, index_path)
+        write_chunk_table(chunk_path, [chunks[row] for row in live_rows])
+        return True
 
-    def search_all_indexes(self, query: str) -> List[Tuple[Dict, float]]:
-        log_event("PROCESS", "Generating embedding for search query")
-        query_vector = embed_text(query)
-        query_vector_np = np.array([query_vector]).astype("float32")
-        
-        faiss.normalize_L2(query_vector_np)
-        
-        all_results = []
-        filtered_results = []
-
-        log_event("PROCESS", f"Searching through indexes with similarity threshold: {self.SIMILARITY_THRESHOLD}")
-        for index_file in os.listdir(INDEX_DIR):
-            if not index_file.endswith(".index"):
-                continue
-
-            file_name = index_file.replace("_index.index", "")
-            chunk_path = os.path.join(CHUNKS_DIR, f"{file_name}_chunks.json")
-
-            if not os.path.exists(chunk_path):
-                continue
-
-            try:
-                with open(chunk_path, "r", encoding="utf-8") as f:
-                    chunk_data = json.load(f)
-                
-                index = faiss.read_index(os.path.join(INDEX_DIR, index_file))
-
-                search_k = min(self.TOP_K_RESULTS * 3, 50)  
-                distances, indices = index.search(query_vector_np, search_k)
-
-                for i, score in zip(indices[0], distances[0]):
-                    if i == -1:
-                        continue  
-                    
-                    if score < self.SIMILARITY_THRESHOLD:
-                        continue  
-                    
-                    chunk_ids = list(chunk_data.keys())
-                    if i < len(chunk_ids):
-                        chunk_id = chunk_ids[i]
-                        chunk = chunk_data.get(chunk_id)
-                        if chunk:
-                            all_results.append((chunk, float(score)))
-            
-            except Exception as e:
-                log_event("ERROR", f"Error searching index {file_name}: {e}")
-                continue
 
-        all_results.sort(key=lambda x: x[1], reverse=True)
-        
-        filtered_count = len(all_results)
-        final_results = all_results[:self.TOP_K_RESULTS]
-        
-        log_event("SUCCESS", f"Found {filtered_count} relevant results (score >= {self.SIMILARITY_THRESHOLD})")
-        return final_results
-    
+    def file_hash_path(self, file_name: str) -> str:
+        return os.path.join(FILES_DIR, f"{file_name}.sha256")
 
-    def followup_search(self, query, max_chunks:int=5, threshold:float=0.8):
 
-        query_vector = embed_text(query)
-        query_vector_np = np.array([query_vector]).astype("float32")
+    def get_file_hash(self, file_name: str) -> Optional[str]:
+        path = self.file_hash_path(file_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
 
-        faiss.normalize_L2(query_vector_np)
 
-        all_results = []
+    def save_file_hash(self, file_name: str, sha256: str) -> None:
+        with open(self.file_hash_path(file_name), "w", encoding="utf-8") as f:
+            f.write(sha256)
 
-        for index_file in os.listdir(INDEX_DIR):
-            if not index_file.endswith(".index"):
-                continue
 
+    def is_indexed(self, file_name: str) -> bool:
+        index_path = os.path.join(INDEX_DIR, f"{file_name}_index.index")
+        return os.path.exists(index_path) and os.path.exists(chunk_table_path(file_name))
 
-            file_name = index_file.replace("_index.index", "")
-            chunks_path = os.path.join(CHUNKS_DIR, f"{file_name}_chunks.json")
 
-            if not os.path.exists(chunks_path):
-                continue
+    def delete_data_files(self, file_name: str) -> None:
+        index_path = os.path.join(INDEX_DIR, f"{file_name}_index.index")
+        chunk_path = chunk_table_path(file_name)
+        legacy_chunk_path = legacy_chunk_table_path(file_name)
 
-            index_path = os.path.join(INDEX_DIR, index_file)
+        for path in [index_path, chunk_path, chunk_rows_path(chunk_path), legacy_chunk_path, self.file_hash_path(file_name)]:
+            if os.path.exists(path):
+                os.remove(path)
 
-            with open(chunks_path, "r", encoding="utf-8") as f:
-                chunks_data = json.load(f)
 
-            index = faiss.read_index(index_path)
+    def _query_cache_key(self, query: str) -> Tuple[str, str]:
+        config = ConfigHandler().load_config()
+        _model, cache_model, _options = embedding_settings(config)
+        query_vector_cache.reset_if_changed(cache_model)
+        query_vector_cache.configure(
+            max_size=config.get("query_cache_max_entries", 1024),
+            ttl_seconds=config.get("query_cache_ttl_seconds", 3600),
+        )
+        # The normalized text is also what gets embedded, so every spelling that shares a key
+        # gets the same vector no matter which one arrived first.
+        return cache_model, " ".join(query.lower().split())
+
+
+    def _normalize_query_vector(self, key: Tuple[str, str], query_vector: List[float]) -> np.ndarray:
+        query_vector_np = np.array([query_vector]).astype("float32")
+        faiss.normalize_L2(query_vector_np)
 
-            search_k = min(max_chunks * 4, 50)  
+        query_vector_cache.set(key, query_vector_np)
+        return query_vector_np
 
-            distances, indices = index.search(query_vector_np, search_k)  
 
-            for i, score in zip(indices[0], distances[0]):
+    def embed_query(self, query: str) -> np.ndarray:
+        key = self._query_cache_key(query)
+        query_vector_np = query_vector_cache.get(key)
+        if query_vector_np is not None:
+            log_event("INFO", "Query embedding served from cache.")
+            return query_vector_np
 
-                if i == -1:
-                    continue
+        return self._normalize_query_vector(key, embed_text(key[1]))
 
 
-                if score < threshold:
-                    continue
+    async def aembed_query(self, query: str) -> np.ndarray:
+        key = self._query_cache_key(query)
+        query_vector_np = query_vector_cache.get(key)
+        if query_vector_np is not None:
+            log_event("INFO", "Query embedding served from cache.")
+            return query_vector_np
+
+        return self._normalize_query_vector(key, await aembed_text(key[1]))
+
+
+    def search_by_vector(self, query_vector_np: np.ndarray, top_k: int, threshold: float) -> List[Tuple[Dict, float]]:
+        all_results = []
 
-                chunk_ids = list(chunks_data.keys())
+        for chunk, score in index_registry.search(query_vector_np, top_k):
+            if score < threshold:
+                continue  
 
-                if i < len(chunk_ids):
-                    chunk_id = chunk_ids[i]
-                    chunk = chunks_data.get(chunk_id)
-                    if chunk:
-                        all_results.append((chunk, float(score)))
+            all_results.append((chunk, score))
 
         all_results.sort(key=lambda x: x[1], reverse=True)
+        return all_results[:top_k]
+
+
+    def search_all_indexes(self, query: str) -> List[Tuple[Dict, float]]:
+        log_event("PROCESS", "Generating embedding for search query")
+        with query_stage_seconds.time(stage="embed"):
+            query_vector_np = self.embed_query(query)
+        with query_stage_seconds.time(stage="search"):
+            return self._search_all_indexes(query_vector_np)
+
+
+    async def asearch_all_indexes(self, query: str) -> List[Tuple[Dict, float]]:
+        log_event("PROCESS", "Generating embedding for search query")
+        with query_stage_seconds.time(stage="embed"):
+            query_vector_np = await self.aembed_query(query)
+        # Searching can stat, reload or rebuild indexes under the registry lock, so it runs off the event loop.
+        with query_stage_seconds.time(stage="search"):
+            return await asyncio.to_thread(self._search_all_indexes, query_vector_np)
 
-        final_reesults = all_results[:max_chunks]
 
-        return final_reesults
+    def _search_all_indexes(self, query_vector_np: np.ndarray) -> List[Tuple[Dict, float]]:
+        threshold = self.SIMILARITY_THRESHOLD
 
+        log_event("PROCESS", f"Searching corpus index with similarity threshold: {threshold}")
+        final_results = self.search_by_vector(query_vector_np, self.TOP_K_RESULTS, threshold)
 
-             
+        log_event("SUCCESS", f"Found {len(final_results)} relevant results (score >= {threshold})")
+        return final_results
+    
+
+    def followup_search(self, query, max_chunks:int=5, threshold:float=0.8):
+        query_vector_np = self.embed_query(query)
+        return self.search_by_vector(query_vector_np, max_chunks, threshold)
 
 
+    async def afollowup_search(self, query, max_chunks:int=5, threshold:float=0.8):
+        query_vector_np = await self.aembed_query(query)
+        return await asyncio.to_thread(self.search_by_vector, query_vector_np, max_chunks, threshold)
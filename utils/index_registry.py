@@ -0,0 +1,438 @@
+import os, sys
+import time
+import threading
+import faiss
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.logger import log_event
+from utils.config_handler import ConfigHandler
+from utils.chunk_store import chunk_table_path, read_chunk_table, migrate_legacy_chunk_table, MappedChunkTable
+from app.config import CHUNKS_DIR, INDEX_DIR, INDEX_REFRESH_INTERVAL, INDEX_MMAP
+
+# Corpus ids are (slot << ROW_BITS) | row, so the id alone resolves to a file and a chunk row.
+ROW_BITS = 32
+ROW_MASK = (1 << ROW_BITS) - 1
+
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+# float16 halves vector memory and disk size, sq8 (8-bit scalar quantization) quarters it.
+VECTOR_STORAGE_TYPES = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+# Per-file indexes are the source the corpus index is rebuilt from, so they are never stored
+# as sq8: ranges trained on one file's vectors clip later rows, and quantizing twice compounds.
+FILE_VECTOR_STORAGE = {"float32": "float32", "float16": "float16", "sq8": "float16"}
+INDEX_DEFAULTS = {
+    "index_type": "flat",
+    "vector_storage": "float32",
+    "ivf_nlist": 1024,
+    "ivf_nprobe": 16,
+    "hnsw_m": 32,
+    "hnsw_ef_construction": 200,
+    "hnsw_ef_search": 64,
+}
+# Changing one of these means rebuilding the corpus index; the rest only apply at search time.
+STRUCTURAL_SETTINGS = ("index_type", "vector_storage", "ivf_nlist", "hnsw_m", "hnsw_ef_construction")
+
+
+def index_settings(config: Dict) -> Dict:
+    settings = {key: config.get(key, default) for key, default in INDEX_DEFAULTS.items()}
+    if settings["index_type"] not in INDEX_TYPES:
+        log_event("ERROR", f"Unknown index_type '{settings['index_type']}', using flat.")
+        settings["index_type"] = "flat"
+    if settings["vector_storage"] not in VECTOR_STORAGE_TYPES:
+        log_event("ERROR", f"Unknown vector_storage '{settings['vector_storage']}', using float32.")
+        settings["vector_storage"] = "float32"
+    return settings
+
+
+def build_flat_index(dimension: int, storage: str, training_vectors: np.ndarray) -> faiss.Index:
+    qtype = VECTOR_STORAGE_TYPES.get(storage)
+    if qtype is None:
+        return faiss.IndexFlatIP(dimension)
+    index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+    index.train(training_vectors)
+    return index
+
+
+def build_file_index(dimension: int, storage: str) -> faiss.Index:
+    # float16 needs no training, so rows appended later are encoded as faithfully as the first.
+    qtype = VECTOR_STORAGE_TYPES[FILE_VECTOR_STORAGE.get(storage, "float32")]
+    if qtype is None:
+        return faiss.IndexFlatIP(dimension)
+    return faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+
+
+def build_corpus_index(settings: Dict, dimension: int, training_vectors: np.ndarray) -> faiss.Index:
+    index_type = settings["index_type"]
+    qtype = VECTOR_STORAGE_TYPES[settings["vector_storage"]]
+    if index_type == "ivf":
+        # Keep roughly 39+ training points per list, as faiss recommends.
+        nlist = max(1, min(settings["ivf_nlist"], len(training_vectors) // 39))
+        quantizer = faiss.IndexFlatIP(dimension)
+        if qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # Encode the vectors themselves rather than residuals, so the quantizer ranges can
+            # be checked against incoming vectors directly (see quantizer_clips).
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, qtype, faiss.METRIC_INNER_PRODUCT, False
+            )
+        index.train(training_vectors)
+        return index
+    if index_type == "hnsw":
+        if qtype is None:
+            hnsw = faiss.IndexHNSWFlat(dimension, settings["hnsw_m"], faiss.METRIC_INNER_PRODUCT)
+        else:
+            hnsw = faiss.IndexHNSWSQ(dimension, qtype, settings["hnsw_m"], faiss.METRIC_INNER_PRODUCT)
+            hnsw.train(training_vectors)
+        hnsw.hnsw.efConstruction = settings["hnsw_ef_construction"]
+        return faiss.IndexIDMap(hnsw)
+    return faiss.IndexIDMap(build_flat_index(dimension, settings["vector_storage"], training_vectors))
+
+
+def quantizer_clips(index: faiss.Index, vectors: np.ndarray) -> bool:
+    # sq8 stores each dimension within the min/max seen in training; vectors outside those
+    # ranges would be clipped (an updated chunk can score 0), so the index has to be retrained.
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    sq = getattr(index, "sq", None)
+    if sq is None or sq.qtype != faiss.ScalarQuantizer.QT_8bit or not len(vectors):
+        return False
+    vmin, vdiff = faiss.vector_to_array(sq.trained).reshape(2, -1)
+    return bool(((vectors < vmin - 1e-6) | (vectors > vmin + vdiff + 1e-6)).any())
+
+
+def apply_search_params(index: faiss.Index, settings: Dict) -> None:
+    if settings["index_type"] == "ivf":
+        index.nprobe = settings["ivf_nprobe"]
+    elif settings["index_type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = settings["hnsw_ef_search"]
+
+
+def supports_removal(settings: Dict) -> bool:
+    # HNSW graphs cannot drop vectors, so removals there rebuild the corpus index.
+    return settings["index_type"] != "hnsw"
+
+
+class IndexRegistry:
+    def __init__(self, index_dir=INDEX_DIR, chunks_dir=CHUNKS_DIR, refresh_interval=INDEX_REFRESH_INTERVAL,
+                 mmap=INDEX_MMAP):
+        self.index_dir = index_dir
+        self.chunks_dir = chunks_dir
+        self.refresh_interval = refresh_interval
+        # In mmap mode each file's index and chunk table stay on disk, mapped read-only, and
+        # are searched in turn; pages live in the OS cache shared by every worker process.
+        self.mmap = mmap
+        self._entries = {}
+        self._slots = []
+        self._index = None
+        self._settings = None
+        self._trained_on = 0
+        self.version = 0
+        self._last_refresh = 0.0
+        self._lock = threading.RLock()
+
+    def _paths(self, file_name: str) -> Tuple[str, str]:
+        index_path = os.path.join(self.index_dir, f"{file_name}_index.index")
+        chunk_path = chunk_table_path(file_name, self.chunks_dir)
+        return index_path, chunk_path
+
+    def _signature(self, file_name: str) -> Optional[Tuple]:
+        index_path, chunk_path = self._paths(file_name)
+        try:
+            index_stat = os.stat(index_path)
+            chunk_stat = os.stat(chunk_path)
+        except FileNotFoundError:
+            return None
+        return (index_stat.st_mtime_ns, index_stat.st_size, chunk_stat.st_mtime_ns, chunk_stat.st_size)
+
+    def _stored_files(self) -> List[str]:
+        return [
+            f.replace("_index.index", "")
+            for f in os.listdir(self.index_dir)
+            if f.endswith("_index.index")
+        ]
+
+    def _allocate_slot(self, file_name: str) -> int:
+        for slot, owner in enumerate(self._slots):
+            if owner is None:
+                self._slots[slot] = file_name
+                return slot
+        self._slots.append(file_name)
+        return len(self._slots) - 1
+
+    def _slot_range(self, slot: int) -> Tuple[int, int]:
+        return slot << ROW_BITS, (slot + 1) << ROW_BITS
+
+    @staticmethod
+    def _find_preamble(chunks: List[Dict]) -> Optional[Dict]:
+        for chunk in chunks:
+            if chunk.get("preamble") and not chunk.get("deleted"):
+                return chunk
+        return None
+
+    def preamble_for(self, chunk: Dict) -> Optional[Dict]:
+        entry = self._entries.get(chunk.get("file"))
+        return entry["preamble"] if entry else None
+
+    @property
+    def file_count(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def vector_count(self) -> int:
+        with self._lock:
+            if self.mmap:
+                return sum(entry["index"].ntotal - entry["deleted"] for entry in self._entries.values())
+            return self._index.ntotal if self._index is not None else 0
+
+    def _current_settings(self) -> Dict:
+        return index_settings(ConfigHandler().load_config())
+
+    def _settings_changed(self, settings: Dict) -> bool:
+        return self._settings is not None and any(settings[key] != self._settings[key] for key in STRUCTURAL_SETTINGS)
+
+    def _needs_rebuild(self, settings: Dict, vectors: Optional[np.ndarray] = None) -> bool:
+        if self._index is None or self._index.ntotal == 0 or self._settings is None:
+            return True
+        if self._settings_changed(settings):
+            return True
+        if vectors is not None and quantizer_clips(self._index, vectors):
+            return True
+        # IVF lists trained on a small corpus get too few as it grows, so retrain past 4x.
+        adding = len(vectors) if vectors is not None else 0
+        if self._index.ntotal + adding <= 4 * max(self._trained_on, 1):
+            return False
+        return settings["index_type"] == "ivf" and self._index.nlist < settings["ivf_nlist"]
+
+    def _live_vectors(self, file_name: str, entry: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        index_path, _ = self._paths(file_name)
+        file_index = faiss.read_index(index_path)
+        rows = np.array([row for row, chunk in enumerate(entry["chunks"]) if not chunk.get("deleted")], dtype="int64")
+        vectors = file_index.reconstruct_n(0, file_index.ntotal)[rows] if len(rows) else np.zeros((0, file_index.d), dtype="float32")
+        start, _ = self._slot_range(entry["slot"])
+        return vectors, start + rows
+
+    def _rebuild(self, settings: Dict) -> None:
+        with self._lock:
+            parts = [self._live_vectors(file_name, entry) for file_name, entry in self._entries.items()]
+            parts = [(vectors, ids) for vectors, ids in parts if len(ids)]
+            if not parts:
+                self._index, self._settings, self._trained_on = None, settings, 0
+                return
+
+            vectors = np.concatenate([vectors for vectors, _ in parts])
+            ids = np.concatenate([ids for _, ids in parts])
+            started = time.perf_counter()
+            self._index = build_corpus_index(settings, vectors.shape[1], vectors)
+            self._index.add_with_ids(vectors, ids)
+            self._settings, self._trained_on = settings, len(vectors)
+            self.version += 1
+        log_event(
+            "SUCCESS",
+            f"Built {settings['index_type']} corpus index over {len(vectors)} vectors "
+            f"in {time.perf_counter() - started:.2f}s.",
+        )
+
+    def _load_mapped_file(self, file_name: str, signature: Tuple) -> None:
+        index_path, chunk_path = self._paths(file_name)
+        chunks = MappedChunkTable(chunk_path)
+        file_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+
+        if file_index.ntotal != len(chunks):
+            chunks.close()
+            raise ValueError(f"Index for {file_name} has {file_index.ntotal} vectors but {len(chunks)} chunks.")
+
+        with self._lock:
+            self.remove_file(file_name)
+            deleted_rows = set(chunks.deleted_rows().tolist())
+            self._entries[file_name] = {
+                "chunks": chunks,
+                "index": file_index,
+                "deleted": len(deleted_rows),
+                "deleted_rows": deleted_rows,
+                "preamble": chunks.preamble(),
+                "signature": signature,
+                "slot": self._allocate_slot(file_name),
+            }
+            self.version += 1
+        log_event("SUCCESS", f"Mapped index for {file_name} into registry ({file_index.ntotal} vectors).")
+
+    def _search_mapped(self, query_vector_np: np.ndarray, k: int) -> List[Tuple[Dict, float]]:
+        hits = []
+        for entry in self._entries.values():
+            file_index = entry["index"]
+            if file_index.ntotal == 0:
+                continue
+            # Ask for extra rows so tombstoned ones can be dropped without losing results.
+            distances, rows = file_index.search(query_vector_np, min(k + entry["deleted"], file_index.ntotal))
+            deleted = entry["deleted_rows"]
+            hits.extend(
+                (float(score), entry, int(row))
+                for row, score in zip(rows[0], distances[0])
+                if row != -1 and row not in deleted
+            )
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [(entry["chunks"][row], score) for score, entry, row in hits[:k]]
+
+    def load_file(self, file_name: str) -> None:
+        signature = self._signature(file_name)
+        if signature is None:
+            self.remove_file(file_name)
+            return
+
+        if self.mmap:
+            self._load_mapped_file(file_name, signature)
+            return
+
+        index_path, chunk_path = self._paths(file_name)
+        chunks = read_chunk_table(chunk_path)
+        file_index = faiss.read_index(index_path)
+        vectors = file_index.reconstruct_n(0, file_index.ntotal)
+
+        if file_index.ntotal != len(chunks):
+            raise ValueError(f"Index for {file_name} has {file_index.ntotal} vectors but {len(chunks)} chunks.")
+
+        with self._lock:
+            self.remove_file(file_name)
+
+            if self._index is not None and self._index.ntotal and self._index.d != file_index.d:
+                raise ValueError(
+                    f"Index for {file_name} has dimension {file_index.d}, corpus index has {self._index.d}."
+                )
+
+            slot = self._allocate_slot(file_name)
+            start, _ = self._slot_range(slot)
+            # Tombstoned rows keep their position in the table but never reach the corpus index.
+            live_rows = np.array([row for row, chunk in enumerate(chunks) if not chunk.get("deleted")], dtype="int64")
+
+            self._entries[file_name] = {
+                "chunks": chunks,
+                "preamble": self._find_preamble(chunks),
+                "signature": signature,
+                "slot": slot,
+            }
+
+            settings = self._current_settings()
+            if self._needs_rebuild(settings, vectors[live_rows]):
+                self._rebuild(settings)
+            elif len(live_rows):
+                self._index.add_with_ids(vectors[live_rows], start + live_rows)
+            self.version += 1
+        log_event("SUCCESS", f"Loaded index for {file_name} into registry ({file_index.ntotal} vectors).")
+
+    def apply_diff(self, file_name: str, chunks: List[Dict], removed_rows: List[int],
+                   first_row: int, vectors_np: np.ndarray) -> None:
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is None or self.mmap:
+                # The diff is already on disk; mapped files are simply reopened.
+                self.load_file(file_name)
+                return
+
+            signature = self._signature(file_name)
+            if entry["signature"] == signature:
+                # A refresh since the diff was written already reloaded the file from disk;
+                # adding the rows again would duplicate their ids in the corpus index.
+                return
+
+            entry["chunks"] = chunks
+            entry["preamble"] = self._find_preamble(chunks)
+            entry["signature"] = signature
+
+            settings = self._current_settings()
+            if (removed_rows and not supports_removal(settings)) or self._needs_rebuild(settings, vectors_np):
+                self._rebuild(settings)
+            else:
+                start, _ = self._slot_range(entry["slot"])
+                if removed_rows:
+                    self._index.remove_ids(start + np.array(removed_rows, dtype="int64"))
+                if len(vectors_np):
+                    ids = np.arange(start + first_row, start + first_row + len(vectors_np), dtype="int64")
+                    self._index.add_with_ids(vectors_np, ids)
+            self.version += 1
+        log_event(
+            "SUCCESS",
+            f"Updated index for {file_name} in registry (+{len(vectors_np)} / -{len(removed_rows)} vectors).",
+        )
+
+    def remove_file(self, file_name: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(file_name, None)
+            if entry is None:
+                return
+            self._slots[entry["slot"]] = None
+            if self.mmap:
+                entry["chunks"].close()
+            else:
+                settings = self._current_settings()
+                if not supports_removal(settings) or self._needs_rebuild(settings):
+                    self._rebuild(settings)
+                else:
+                    start, end = self._slot_range(entry["slot"])
+                    self._index.remove_ids(faiss.IDSelectorRange(start, end))
+            self.version += 1
+        log_event("SUCCESS", f"Removed index for {file_name} from registry.")
+
+    def refresh(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+
+            stored_files = set(self._stored_files())
+
+            for file_name in list(self._entries):
+                if file_name not in stored_files:
+                    self.remove_file(file_name)
+
+            for file_name in stored_files:
+                try:
+                    migrate_legacy_chunk_table(file_name, self.chunks_dir)
+                except Exception as e:
+                    log_event("ERROR", f"Error migrating chunk table for {file_name}: {e}")
+
+                entry = self._entries.get(file_name)
+                signature = self._signature(file_name)
+                if signature is None or (entry and entry["signature"] == signature):
+                    continue
+                try:
+                    self.load_file(file_name)
+                except Exception as e:
+                    log_event("ERROR", f"Error loading index {file_name} into registry: {e}")
+
+    def search(self, query_vector_np: np.ndarray, k: int) -> List[Tuple[Dict, float]]:
+        self.refresh()
+        with self._lock:
+            if self.mmap:
+                return self._search_mapped(query_vector_np, k)
+
+            settings = self._current_settings()
+            if self._settings_changed(settings):
+                self._rebuild(settings)
+            if self._index is None or self._index.ntotal == 0:
+                return []
+            apply_search_params(self._index, settings)
+
+            distances, ids = self._index.search(query_vector_np, min(k, self._index.ntotal))
+
+            results = []
+            for corpus_id, score in zip(ids[0], distances[0]):
+                if corpus_id == -1:
+                    continue
+                file_name = self._slots[corpus_id >> ROW_BITS]
+                chunk = self._entries[file_name]["chunks"][corpus_id & ROW_MASK]
+                results.append((chunk, float(score)))
+            return results
+
+
+index_registry = IndexRegistry()
@@ -0,0 +1,161 @@
+import os, sys
+import json
+import time
+import threading
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.logger import log_event, request_id_var
+from app.config import JOBS_DIR, FILES_DIR, INGESTION_WORKERS
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobHandler:
+    def __init__(self, runners: Dict[str, Callable], jobs_dir=JOBS_DIR, max_workers=INGESTION_WORKERS):
+        # runners map a job kind to fn(file_name, progress) doing the actual work.
+        self.runners = runners
+        self.jobs_dir = jobs_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self._lock = threading.Lock()
+        # Jobs and deletes for the same file run one at a time, so they never interleave.
+        self._file_locks: Dict[str, threading.Lock] = {}
+
+    def file_lock(self, file_name: str) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(file_name, threading.Lock())
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: Dict) -> None:
+        path = self._job_path(job["id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _load_jobs(self):
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith(".json"):
+                job = self.get(name[:-len(".json")])
+                if job is not None:
+                    yield job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        if not job_id.isalnum():
+            return None
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+        with self._lock:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+    def _update(self, job_id: str, **fields) -> Dict:
+        with self._lock:
+            with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                job = json.load(f)
+            # A cancelled job stays cancelled; the worker stops at its next progress report.
+            if job["status"] == "cancelled" and "status" in fields:
+                raise JobCancelled(job_id)
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._save(job)
+            return job
+
+    def submit(self, kind: str, file_name: str) -> Dict:
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        now = time.time()
+        job = {
+            "id": uuid4().hex,
+            "kind": kind,
+            "file_name": file_name,
+            "status": "queued",
+            "progress": {},
+            "error": None,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._save(job)
+
+        self._executor.submit(self._run, job["id"])
+        log_event("PROCESS", f"Queued {kind} job {job['id']} for {file_name}.")
+        return job
+
+    def _run(self, job_id: str) -> None:
+        job = self.get(job_id)
+        if job is None:
+            return
+
+        # Log records from the job's worker thread carry the job id as their request id.
+        request_id_var.set(job_id)
+
+        def progress(stage: str, **details):
+            self._update(job_id, status=stage, progress={"stage": stage, **details})
+
+        file_name = job["file_name"]
+        with self.file_lock(file_name):
+            try:
+                job = self._update(job_id, attempts=job.get("attempts", 0) + 1)
+                if job["status"] == "cancelled":
+                    raise JobCancelled(job_id)
+                # The file may have been deleted while the job waited; writing its index now
+                # would leave an orphan that no endpoint can remove.
+                if not os.path.exists(os.path.join(FILES_DIR, f"{file_name}.pdf")):
+                    self._update(job_id, status="cancelled", error="File was deleted.")
+                    log_event("INFO", f"Job {job_id} for {file_name} skipped: file was deleted.")
+                    return
+                self.runners[job["kind"]](file_name, progress=progress)
+                self._update(job_id, status="completed", progress={"stage": "completed"})
+                log_event("SUCCESS", f"Job {job_id} for {file_name} completed.")
+            except JobCancelled:
+                log_event("INFO", f"Job {job_id} for {file_name} was cancelled.")
+            except Exception as e:
+                try:
+                    self._update(job_id, status="failed", error=str(e))
+                except JobCancelled:
+                    pass
+                log_event("ERROR", f"Job {job_id} for {file_name} failed: {e}")
+
+    def cancel_file_jobs(self, file_name: str) -> int:
+        cancelled = 0
+        for job in self._load_jobs():
+            if job["file_name"] != file_name or job["status"] in TERMINAL_STATUSES:
+                continue
+            try:
+                self._update(job["id"], status="cancelled", error="File was deleted.")
+                cancelled += 1
+            except JobCancelled:
+                pass
+        if cancelled:
+            log_event("INFO", f"Cancelled {cancelled} ingestion jobs for {file_name}.")
+        return cancelled
+
+    def resume_pending(self) -> int:
+        resumed = 0
+        # Oldest first, so an upload still runs before a later update of the same file.
+        for job in sorted(self._load_jobs(), key=lambda job: job["created_at"]):
+            if job["status"] in TERMINAL_STATUSES:
+                continue
+
+            # Stages are idempotent (the embedding cache keeps finished vectors), so an
+            # interrupted job simply runs again from the start.
+            self._update(job["id"], status="queued", progress={})
+            self._executor.submit(self._run, job["id"])
+            resumed += 1
+
+        if resumed:
+            log_event("PROCESS", f"Resumed {resumed} interrupted ingestion jobs.")
+        return resumed
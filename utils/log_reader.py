@@ -0,0 +1,149 @@
+import os, sys
+import json
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.logger import EVENT_LEVELS
+from app.config import LOGS_FILE, LOG_BACKUP_COUNT
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def parse_record(line: str) -> Dict:
+    try:
+        record = json.loads(line)
+        if isinstance(record, dict):
+            return record
+    except ValueError:
+        pass
+    # Lines written before logs were structured.
+    return {"time": None, "level": None, "request_id": None, "message": line}
+
+
+def log_files(path: str = LOGS_FILE, backup_count: int = LOG_BACKUP_COUNT) -> List[str]:
+    # Newest first: the live file, then the rotated backups .1, .2, ...
+    candidates = [path] + [f"{path}.{i}" for i in range(1, backup_count + 1)]
+    return [candidate for candidate in candidates if os.path.exists(candidate)]
+
+
+def iter_lines_reverse(path: str) -> Iterator[str]:
+    # Reads fixed-size blocks backwards from the end, so recent lines cost the same
+    # however large the file has grown.
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            size = min(READ_BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line.decode("utf-8", errors="replace")
+        if remainder.strip():
+            yield remainder.decode("utf-8", errors="replace")
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    # Log timestamps are naive local time, so filters with an offset are converted to match.
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def read_logs(offset: int = 0, limit: int = 200, level: Optional[str] = None, since: Optional[str] = None,
+              until: Optional[str] = None, request_id: Optional[str] = None, path: str = LOGS_FILE) -> Dict:
+    # Pages newest first; offset counts matching records from the most recent one.
+    min_level = EVENT_LEVELS[level.upper()] if level else None
+    since_time, until_time = _parse_time(since), _parse_time(until)
+
+    records, skipped, has_more = [], 0, False
+    for log_path in log_files(path):
+        for line in iter_lines_reverse(log_path):
+            record = parse_record(line)
+
+            if since_time or until_time:
+                record_time = _parse_time(record.get("time"))
+                if record_time is None:
+                    continue
+                if since_time and record_time < since_time:
+                    # Everything further back is older still.
+                    return {"logs": records, "offset": offset, "limit": limit, "next_offset": None}
+                if until_time and record_time > until_time:
+                    continue
+            if min_level is not None and EVENT_LEVELS.get(record.get("level"), -1) < min_level:
+                continue
+            if request_id and record.get("request_id") != request_id:
+                continue
+
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(records) == limit:
+                has_more = True
+                break
+            records.append(record)
+        if has_more:
+            break
+
+    return {
+        "logs": records,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+def _read_backlog(path: str, lines: int) -> Tuple[List[Dict], int, Optional[int]]:
+    if not os.path.exists(path):
+        return [], 0, None
+    backlog = []
+    for line in iter_lines_reverse(path):
+        if len(backlog) == lines:
+            break
+        backlog.append(parse_record(line))
+    stat = os.stat(path)
+    return backlog[::-1], stat.st_size, stat.st_ino
+
+
+def _read_appended(path: str, position: int, inode: Optional[int],
+                   partial: bytes) -> Tuple[List[Dict], int, Optional[int], bytes]:
+    if not os.path.exists(path):
+        return [], position, inode, partial
+
+    stat = os.stat(path)
+    if stat.st_ino != inode or stat.st_size < position:
+        # The file was rotated: start over at the top of the new one.
+        inode, position, partial = stat.st_ino, 0, b""
+    if stat.st_size == position:
+        return [], position, inode, partial
+
+    with open(path, "rb") as f:
+        f.seek(position)
+        data = partial + f.read(stat.st_size - position)
+
+    *complete, partial = data.split(b"\n")
+    records = [parse_record(line.decode("utf-8", errors="replace")) for line in complete if line.strip()]
+    return records, stat.st_size, inode, partial
+
+
+async def follow_logs(path: str = LOGS_FILE, lines: int = 50, poll_interval: float = 1.0) -> AsyncIterator[Dict]:
+    # File reads run in a worker thread, so a tailing client never blocks the event loop.
+    backlog, position, inode = await asyncio.to_thread(_read_backlog, path, lines)
+    for record in backlog:
+        yield record
+
+    partial = b""
+    while True:
+        await asyncio.sleep(poll_interval)
+        records, position, inode, partial = await asyncio.to_thread(_read_appended, path, position, inode, partial)
+        for record in records:
+            yield record
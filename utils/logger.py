@@ -1,20 +1,79 @@
+import atexit
+import json
 import logging
 import os, sys 
+import queue
+import random
+from contextvars import ContextVar
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.config import LOGS_FILE
-
-logging.basicConfig(
-    filename=LOGS_FILE,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
+from app.config import (
+    LOGS_FILE, LOG_LEVEL, LOG_MAX_FIELD_CHARS, LOG_PAYLOAD_SAMPLE_RATE, LOG_TO_STDOUT, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
 )
 
+# DEBUG carries full prompts and model output; it is below the default level.
+EVENT_LEVELS = {"DEBUG": 10, "PROCESS": 15, "INFO": 20, "SUCCESS": 25, "ERROR": 40}
+
+request_id_var: ContextVar = ContextVar("request_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.event_type,
+            "request_id": record.request_id,
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+def _build_listener(logger: logging.Logger) -> QueueListener:
+    # Callers only enqueue; formatting and file writes happen on the listener thread.
+    records = queue.Queue(-1)
+    logger.addHandler(QueueHandler(records))
+
+    file_handler = RotatingFileHandler(LOGS_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+
+    if LOG_TO_STDOUT:
+        stdout_handler = logging.StreamHandler(sys.stdout)
+        stdout_handler.setFormatter(logging.Formatter("%(event_type)s: %(message)s"))
+        handlers.append(stdout_handler)
+
+    listener = QueueListener(records, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+logger = logging.getLogger("meal_assistant")
+logger.setLevel(EVENT_LEVELS.get(LOG_LEVEL, EVENT_LEVELS["PROCESS"]))
+logger.propagate = False
+listener = _build_listener(logger)
+
+
+def log_enabled(event_type: str) -> bool:
+    return logger.isEnabledFor(EVENT_LEVELS.get(event_type, EVENT_LEVELS["INFO"]))
+
+
+def _truncate(details: str) -> str:
+    if LOG_MAX_FIELD_CHARS <= 0 or len(details) <= LOG_MAX_FIELD_CHARS:
+        return details
+    return f"{details[:LOG_MAX_FIELD_CHARS]}... [truncated {len(details) - LOG_MAX_FIELD_CHARS} chars]"
+
 
 def log_event(event_type: str, details: str):
+    if not log_enabled(event_type):
+        return
+    if event_type == "DEBUG" and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
 
-    message = f"{event_type}: {details}"
-    logging.info(message)
-    print(message)
+    logger.log(
+        EVENT_LEVELS.get(event_type, EVENT_LEVELS["INFO"]),
+        _truncate(str(details)),
+        extra={"event_type": event_type, "request_id": request_id_var.get()},
+    )
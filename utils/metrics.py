@@ -0,0 +1,173 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Tuple
+
+# Minimal Prometheus text-format metrics. Updates are a dict lookup and an add under a lock,
+# so instrumenting hot paths costs microseconds; values that already live elsewhere (cache
+# stats, index sizes) are read by collectors only when /metrics is scraped.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # Per label set: [per-bucket counts (not cumulative), sum, count].
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    async def time_stream(self, stream: AsyncIterator, **labels) -> AsyncIterator:
+        # Counts only the time spent waiting on the stream, not the time the consumer
+        # (e.g. a slow SSE client) takes between items.
+        elapsed = 0.0
+        try:
+            started = time.perf_counter()
+            async for item in stream:
+                elapsed += time.perf_counter() - started
+                yield item
+                started = time.perf_counter()
+            elapsed += time.perf_counter() - started
+        finally:
+            self.observe(elapsed, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        # Collectors return (name, type, documentation, [(labels dict, value), ...]).
+        self._collectors: List[Callable] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    label_names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(label_names, tuple(labels[n] for n in label_names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+query_stage_seconds = metrics.histogram(
+    "meal_assistant_query_stage_seconds", "Time spent in each query pipeline stage.", ("stage",)
+)
+openai_request_seconds = metrics.histogram(
+    "meal_assistant_openai_request_seconds", "Latency of OpenAI API calls.", ("operation", "model")
+)
+openai_tokens_total = metrics.counter(
+    "meal_assistant_openai_tokens_total", "Tokens reported by the OpenAI API usage field.", ("model", "kind")
+)
+query_category_total = metrics.counter(
+    "meal_assistant_query_category_total", "Queries by classified category.", ("category",)
+)
+meal_type_total = metrics.counter(
+    "meal_assistant_meal_type_total", "Food queries by classified meal type.", ("meal_type",)
+)
+
+
+def record_usage(model: str, usage) -> None:
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if prompt_tokens:
+        openai_tokens_total.inc(prompt_tokens, model=model, kind="prompt")
+    if completion_tokens:
+        openai_tokens_total.inc(completion_tokens, model=model, kind="completion")
@@ -0,0 +1,36 @@
+import fitz
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+# Kept free of app imports so pool workers start without loading clients or caches.
+
+# Forking a process that runs uvicorn, job threads and the log listener can copy locks held
+# by other threads, so workers start from a clean forkserver (spawn where that is missing).
+_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> str:
+    with fitz.open(file_path) as doc:
+        return "".join(doc[page_number].get_text() for page_number in range(start, end))
+
+
+def iter_page_texts(file_path: str, workers: int, pages_per_task: int) -> Iterator[str]:
+    with fitz.open(file_path) as doc:
+        page_count = doc.page_count
+
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+    # A pool only pays off once there is more than one range to spread out.
+    if workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield extract_page_range(file_path, start, end)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=_POOL_CONTEXT) as pool:
+        futures = [pool.submit(extract_page_range, file_path, start, end) for start, end in ranges]
+        # Yield in page order as soon as each leading range is ready.
+        for future in futures:
+            yield future.result()
@@ -2,15 +2,19 @@ import os, sys, re
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.api.openai_client import chat_with_gpt 
+from app.api.openai_client import chat_with_gpt, achat_with_gpt, astream_chat_with_gpt
 from utils.logger import log_event
 from utils.config_handler import ConfigHandler
 from utils.token_handler import TokenHandler
 from utils.file_handler import FileHandler
+from utils.index_registry import index_registry
+from utils.metrics import query_category_total, meal_type_total
 
 file_handler = FileHandler()
 token_handler = TokenHandler()
 
+QUERY_CATEGORIES = {"0": "food", "1": "greeting", "2": "other", "3": "follow_up"}
+
 class PipelineReturn(Exception):
 
     def __init__(self, value, counts_toward_limit):
@@ -34,6 +38,35 @@ class QueryHandler():
         
         return sanitized
 
+    def _raise_for_category(self, response):
+        if str(response) == "2":
+            response = "I need a specific meal to optimize. What are you eating/drinking today?"
+            raise PipelineReturn(value=response, counts_toward_limit=False)
+
+        elif str(response) == "1":
+            response = "Hey hey! Good to see you here 😄\nI need a specific meal or beverage to optimize. What exactly are you eating or drinking?"        
+            raise PipelineReturn(value=response, counts_toward_limit=False)
+
+        elif str(response) == "0":
+            return None
+        
+        else:
+            response = "I need a specific meal to optimize. What are you eating/drinking today?"
+            raise PipelineReturn(value=response, counts_toward_limit=False)
+
+    def _follow_up_prompt(self, follow_ups_prompt, data_chunks):
+        if data_chunks:
+            contents = []
+            for chunk, _score in data_chunks:
+                preamble = index_registry.preamble_for(chunk)
+                if preamble is not None and preamble["content"] not in contents:
+                    contents.append(preamble["content"])
+                if chunk["content"] not in contents:
+                    contents.append(chunk["content"])
+            chunks_text = "\n\n".join(contents)
+            return f"{follow_ups_prompt}\n\n{chunks_text}"
+        return follow_ups_prompt
+
     def identify_query(self, query, prompt, temp, chat_history):
         config = ConfigHandler().load_config()
         follow_ups_limit = config.get("follow_ups_limit", True)
@@ -44,23 +77,13 @@ class QueryHandler():
         
         response = chat_with_gpt(system_prompt=prompt, user_query=query, temp=temp, max_tokens=1, chat_history=chat_history)
         log_event("SUCCESS", f"Query is {response}")
-        if str(response) == "2":
-            response = "I need a specific meal to optimize. What are you eating/drinking today?"
-            raise PipelineReturn(value=response, counts_toward_limit=False)
+        query_category_total.inc(category=QUERY_CATEGORIES.get(str(response), "unknown"))
 
-        elif str(response) == "1":
-            response = "Hey hey! Good to see you here 😄\nI need a specific meal or beverage to optimize. What exactly are you eating or drinking?"        
-            raise PipelineReturn(value=response, counts_toward_limit=False)
-        
-        elif str(response) == "3":
+        if str(response) == "3":
             log_event("PROCESS", "Query is a follow up, Getting response...")
             try:
                 data_chunks = file_handler.followup_search(query=query)
-                if data_chunks:
-                    chunks_text = "\n\n".join([chunk[0]['content'] for chunk in data_chunks])
-                    follow_up_full_prompt = f"{follow_ups_prompt}\n\n{chunks_text}"
-                else:
-                    follow_up_full_prompt = follow_ups_prompt
+                follow_up_full_prompt = self._follow_up_prompt(follow_ups_prompt, data_chunks)
                     
                 response = chat_with_gpt(system_prompt=follow_up_full_prompt, user_query=query, temp=0.6, chat_history=chat_history)
                 log_event("SUCCESS", "Response to follow up is generated.")
@@ -70,30 +93,70 @@ class QueryHandler():
             
             raise PipelineReturn(value=response, counts_toward_limit=follow_ups_limit)
 
-        elif str(response) == "0":
-            return None
+        return self._raise_for_category(response)
+
+    async def aidentify_query(self, query, prompt, temp, chat_history):
+        config = ConfigHandler().load_config()
+        follow_ups_limit = config.get("follow_ups_limit", True)
+        follow_ups_prompt = config.get("follow_ups_prompt", "")
+
+        if chat_history:
+            chat_history = token_handler.trim_chat_history(chat_history=chat_history)
         
-        else:
-            response = "I need a specific meal to optimize. What are you eating/drinking today?"
-            raise PipelineReturn(value=response, counts_toward_limit=False)
+        response = await achat_with_gpt(system_prompt=prompt, user_query=query, temp=temp, max_tokens=1, chat_history=chat_history)
+        log_event("SUCCESS", f"Query is {response}")
+        query_category_total.inc(category=QUERY_CATEGORIES.get(str(response), "unknown"))
 
-    def get_type(self, query, prompt, temp):
+        if str(response) == "3":
+            log_event("PROCESS", "Query is a follow up, Getting response...")
+            try:
+                data_chunks = await file_handler.afollowup_search(query=query)
+                follow_up_full_prompt = self._follow_up_prompt(follow_ups_prompt, data_chunks)
+                    
+                response = await achat_with_gpt(system_prompt=follow_up_full_prompt, user_query=query, temp=0.6, chat_history=chat_history)
+                log_event("SUCCESS", "Response to follow up is generated.")
+            except Exception as e:
+                log_event("ERROR", f"Error handling follow-up: {e}")
+                response = "I'm having trouble accessing the information right now. Could you rephrase your question?"
+            
+            raise PipelineReturn(value=response, counts_toward_limit=follow_ups_limit)
+
+        return self._raise_for_category(response)
+
+    def _check_type(self, response):
+        meal_type_total.inc(meal_type=response if response in ("A", "B", "C", "D") else "unknown")
         config = ConfigHandler().load_config()
         type_d_limit = config.get("type_d_limit", False)
-        
-        response = chat_with_gpt(system_prompt=prompt, user_query=query, temp=temp, max_tokens=1)
 
         if response == "D":
             response = "Excellent choice!\nThis is already excellent for blood sugar! Nothing to modify here.\nEnjoy and savor every moment."
             raise PipelineReturn(value=response, counts_toward_limit=type_d_limit)
         
         return response
-    
+
+    def get_type(self, query, prompt, temp):
+        response = chat_with_gpt(system_prompt=prompt, user_query=query, temp=temp, max_tokens=1)
+        return self._check_type(response)
+
+    async def aget_type(self, query, prompt, temp):
+        response = await achat_with_gpt(system_prompt=prompt, user_query=query, temp=temp, max_tokens=1)
+        return self._check_type(response)
+
+    def _final_prompt(self, prompt, type):
+        return f"You are analyzing a Type {type}. NEVER NEVER mention this type to the user.\n\n{prompt}"
 
     def get_final_response(self, query, prompt, temp, type):
-        full_prompt = f"You are analyzing a Type {type}. NEVER NEVER mention this type to the user.\n\n{prompt}"
+        full_prompt = self._final_prompt(prompt, type)
+
+        return chat_with_gpt(system_prompt=full_prompt, user_query=query, temp=temp, max_tokens=None)
+
+    async def aget_final_response(self, query, prompt, temp, type):
+        full_prompt = self._final_prompt(prompt, type)
+
+        return await achat_with_gpt(system_prompt=full_prompt, user_query=query, temp=temp, max_tokens=None)
 
-        response = chat_with_gpt(system_prompt=full_prompt, user_query=query, temp=temp, max_tokens=None)
-        log_event("INFO", f": User Query:\n\n{query}\n\nFull System prompt 'Base prompt + Chunks':\n\n{full_prompt}\n\nGPT output:\n\n{response}")
+    async def astream_final_response(self, query, prompt, temp, type):
+        full_prompt = self._final_prompt(prompt, type)
 
-        return response
\ No newline at end of file
+        async for token in astream_chat_with_gpt(system_prompt=full_prompt, user_query=query, temp=temp, max_tokens=None):
+            yield token
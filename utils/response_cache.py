@@ -0,0 +1,95 @@
+import os, sys
+import json
+import hashlib
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.cache_handler import TTLCache
+from utils.index_registry import index_registry
+from utils.logger import log_event
+
+RESPONSE_CACHE_MODES = ("off", "exact", "semantic")
+
+
+class ResponseCache:
+    def __init__(self):
+        self.mode = "off"
+        self.similarity_threshold = 0.95
+        self.hits = 0
+        self.misses = 0
+        self._entries = TTLCache()
+
+    def configure(self, config: dict) -> None:
+        mode = config.get("response_cache_mode", "off")
+        if mode not in RESPONSE_CACHE_MODES:
+            log_event("ERROR", f"Unknown response_cache_mode '{mode}', response cache disabled.")
+            mode = "off"
+
+        self.mode = mode
+        self.similarity_threshold = config.get("response_cache_similarity_threshold", 0.95)
+        self._entries.configure(
+            max_size=config.get("response_cache_max_entries", 1000),
+            ttl_seconds=config.get("response_cache_ttl_seconds", 86400),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def fingerprint(self, config: dict) -> str:
+        config_hash = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return f"{config_hash}:{index_registry.version}"
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get_exact(self, query: str, fingerprint: str) -> Optional[Tuple[str, bool]]:
+        entry = self._entries.get((fingerprint, self._normalize(query)))
+        if entry is None:
+            # Semantic mode records its miss after the similarity lookup.
+            if self.mode == "exact":
+                self.misses += 1
+            return None
+        self.hits += 1
+        log_event("INFO", "Response served from cache (exact match).")
+        return entry["response"], entry["counts_toward_limit"]
+
+    def get_similar(self, query_vector_np: np.ndarray, meal_type: str, fingerprint: str) -> Optional[Tuple[str, bool]]:
+        if self.mode != "semantic":
+            return None
+
+        best_entry, best_score = None, self.similarity_threshold
+        for (entry_fingerprint, _query), entry in self._entries.items():
+            if entry_fingerprint != fingerprint or entry["meal_type"] != meal_type or entry["vector"] is None:
+                continue
+            score = float(np.dot(entry["vector"][0], query_vector_np[0]))
+            if score >= best_score:
+                best_entry, best_score = entry, score
+
+        if best_entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        log_event("INFO", f"Response served from cache (similarity {best_score:.3f}).")
+        return best_entry["response"], best_entry["counts_toward_limit"]
+
+    def store(self, query: str, fingerprint: str, meal_type: str, response: str,
+              counts_toward_limit: bool, query_vector_np: Optional[np.ndarray] = None) -> None:
+        self._entries.set((fingerprint, self._normalize(query)), {
+            "meal_type": meal_type,
+            "vector": query_vector_np,
+            "response": response,
+            "counts_toward_limit": counts_toward_limit,
+        })
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+response_cache = ResponseCache()
@@ -1,5 +1,5 @@
 import tiktoken
-from typing import List, Tuple, Dict
+from typing import Callable, List, Optional, Tuple, Dict
 import os, sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -13,20 +13,187 @@ class TokenHandler:
         config = ConfigHandler().load_config()
         chat_model_name = config.get("chat_model_name", "gpt-3.5-turbo")  
         self.tokenizer = tiktoken.encoding_for_model(chat_model_name)
+        self._base_prompt_tokens = None
+        ConfigHandler.subscribe(self._on_config_change)
+
+    def _on_config_change(self, config: dict) -> None:
+        chat_model_name = config.get("chat_model_name", "gpt-3.5-turbo")
+        try:
+            self.tokenizer = tiktoken.encoding_for_model(chat_model_name)
+        except Exception as e:
+            log_event("ERROR", f"No tokenizer for {chat_model_name}, keeping the previous one: {e}")
 
     def count_tokens(self, text: str) -> int:
         return len(self.tokenizer.encode(text))
 
+    def chunk_tokens(self, chunk: Dict) -> int:
+        # Counts are stored with the chunk at ingest; they are only redone when the
+        # chunk was counted with another tokenizer (or predates stored counts).
+        if chunk.get("token_encoding") != self.tokenizer.name or "tokens" not in chunk:
+            title = str(chunk.get('title', '') or '')
+            content = str(chunk.get('content', '') or '')
+            chunk["tokens"] = self.count_tokens(f"## {title}\n{content}")
+            chunk["token_encoding"] = self.tokenizer.name
+        return chunk["tokens"]
+
+    def annotate_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        for chunk in chunks:
+            self.chunk_tokens(chunk)
+        return chunks
+
+    def base_prompt_tokens(self, base_prompt: str) -> int:
+        # The base prompt only changes with the config, so its count is kept per config version.
+        key = (ConfigHandler().version, self.tokenizer.name, base_prompt)
+        cached = self._base_prompt_tokens
+        if cached is None or cached[0] != key:
+            cached = (key, self.count_tokens(base_prompt))
+            self._base_prompt_tokens = cached
+        return cached[1]
+
+    def batch_by_tokens(self, texts: List[str], max_tokens: int, max_items: int) -> List[List[str]]:
+        batches = []
+        current_batch = []
+        current_tokens = 0
+
+        for text in texts:
+            text_tokens = self.count_tokens(text)
+
+            if current_batch and (current_tokens + text_tokens > max_tokens or len(current_batch) >= max_items):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+
+            current_batch.append(text)
+            current_tokens += text_tokens
+
+        if current_batch:
+            batches.append(current_batch)
+
+        return batches
+
     def format_chunks(self, chunks: List[Dict]) -> str:
         return "\n\n".join(
             f"## {chunk['title']}\n{chunk['content']}" for chunk in chunks
         )
 
+    @staticmethod
+    def _content_key(chunk: Dict) -> str:
+        # Ignores the "from file:" header so the same section in two files counts as a duplicate.
+        content = str(chunk.get('content', '') or '')
+        if content.startswith("from file:"):
+            content = content.split("\n", 1)[-1]
+        return " ".join(content.lower().split())
+
+    def _unit(self, chunk: Dict, preamble_for, included_preambles: set) -> Optional[List[Dict]]:
+        # A file's preamble goes in once, right before the first chunk that needs it.
+        if chunk.get("preamble"):
+            return None if chunk["id"] in included_preambles else [chunk]
+        preamble = preamble_for(chunk) if preamble_for else None
+        if preamble is None or preamble["id"] in included_preambles:
+            return [chunk]
+        return [preamble, chunk]
+
+    @staticmethod
+    def _include(unit: List[Dict], included_preambles: set) -> None:
+        for item in unit:
+            if item.get("preamble"):
+                included_preambles.add(item["id"])
+
+    def _select_by_density(self, candidates: List[Tuple[Dict, float]], available_tokens: int, preamble_for) -> set:
+        # Repeatedly takes the fitting chunk with the best score per token, so one large
+        # chunk cannot crowd out several smaller ones. Preamble costs shrink to zero once
+        # their file is in, hence the re-evaluation each round.
+        # Preambles already brought in by their file are skipped, not selected, so their
+        # scores never count toward the pick.
+        selected, skipped, included_preambles, used_tokens = set(), set(), set(), 0
+        while True:
+            best = None
+            for i, (chunk, score) in enumerate(candidates):
+                if i in selected or i in skipped:
+                    continue
+                unit = self._unit(chunk, preamble_for, included_preambles)
+                if unit is None:
+                    skipped.add(i)
+                    continue
+                cost = sum(self.chunk_tokens(item) for item in unit)
+                if used_tokens + cost > available_tokens:
+                    continue
+                density = max(score, 0.0) / max(cost, 1)
+                if best is None or density > best[0]:
+                    best = (density, i, unit, cost)
+            if best is None:
+                break
+            _density, i, unit, cost = best
+            selected.add(i)
+            used_tokens += cost
+            self._include(unit, included_preambles)
+
+        # Density alone can miss a single high-score chunk worth more than the whole pick.
+        best_single = None
+        for i, (chunk, score) in enumerate(candidates):
+            cost = sum(self.chunk_tokens(item) for item in self._unit(chunk, preamble_for, set()))
+            if cost <= available_tokens and (best_single is None or score > best_single[1]):
+                best_single = (i, score)
+        selected_score = sum(candidates[i][1] for i in selected)
+        if best_single is not None and best_single[1] > selected_score:
+            return {best_single[0]}
+        return selected
+
+    def pack_chunks(
+        self,
+        retrieved_chunks: List[Tuple[Dict, float]],
+        available_tokens: int,
+        mode: str = "greedy",
+        preamble_for: Optional[Callable[[Dict], Optional[Dict]]] = None
+    ) -> Tuple[List[Dict], int]:
+        if mode == "score_per_token":
+            candidates, seen = [], set()
+            for chunk, score in retrieved_chunks:
+                key = self._content_key(chunk)
+                if key in seen:
+                    continue
+                seen.add(key)
+                candidates.append((chunk, score))
+            selected = self._select_by_density(candidates, available_tokens, preamble_for)
+            candidates = [candidate for i, candidate in enumerate(candidates) if i in selected]
+            stop_when_full = False
+        else:
+            if mode != "greedy":
+                log_event("ERROR", f"Unknown context_packing '{mode}', using greedy.")
+            candidates = retrieved_chunks
+            stop_when_full = True
+
+        # Selected chunks keep their retrieval order in the prompt.
+        final_chunks = []
+        total_chunk_tokens = 0
+        included_preambles = set()
+
+        for chunk, _score in candidates:
+            unit = self._unit(chunk, preamble_for, included_preambles)
+            if unit is None:
+                continue
+            unit_tokens = sum(self.chunk_tokens(item) for item in unit)
+
+            if total_chunk_tokens + unit_tokens > available_tokens:
+                if stop_when_full:
+                    break
+                continue
+
+            final_chunks.extend(
+                {'title': str(item.get('title', '') or ''), 'content': str(item.get('content', '') or '')}
+                for item in unit
+            )
+            total_chunk_tokens += unit_tokens
+            self._include(unit, included_preambles)
+
+        return final_chunks, total_chunk_tokens
+
     def build_prompt_within_limit(
         self,
         base_prompt: str,
         user_query: str,
-        retrieved_chunks: List[Tuple[Dict, float]]
+        retrieved_chunks: List[Tuple[Dict, float]],
+        preamble_for: Optional[Callable[[Dict], Optional[Dict]]] = None
     ) -> Tuple[str, str]:
         try:
             log_event("PROCESS", "Building prompt with token limit handling.")
@@ -36,7 +203,7 @@ class TokenHandler:
 
 
 
-            system_tokens = self.count_tokens(base_prompt)
+            system_tokens = self.base_prompt_tokens(base_prompt)
             query_tokens = self.count_tokens(user_query)
             available_tokens = token_limit - system_tokens - query_tokens
 
@@ -44,27 +211,16 @@ class TokenHandler:
                 log_event("ERROR", "Token limit exceeded by prompt and query alone.")
                 raise ValueError("Prompt and query exceed the token limit.")
 
-            final_chunks = []
-            total_chunk_tokens = 0
-
-            for chunk, _score in retrieved_chunks:
-                title = str(chunk.get('title', '') or '')
-                content = str(chunk.get('content', '') or '')
-
-                chunk_text = f"## {title}\n{content}"
-                chunk_tokens = self.count_tokens(chunk_text)
+            packing = config.get("context_packing", "greedy")
+            final_chunks, total_chunk_tokens = self.pack_chunks(
+                retrieved_chunks, available_tokens, mode=packing, preamble_for=preamble_for
+            )
 
-                if total_chunk_tokens + chunk_tokens > available_tokens:
-                    break
-
-                final_chunks.append({'title': title, 'content': content})
-                total_chunk_tokens += chunk_tokens
-                
             context_text = self.format_chunks(final_chunks)
             full_system_prompt = f"{base_prompt}\n\n{context_text}"
 
-            log_event("SUCCESS", f"Prompt built successfully with {len(final_chunks)} chunks.")
-            return user_query, full_system_prompt
+            log_event("SUCCESS", f"Prompt built successfully with {len(final_chunks)} chunks ({total_chunk_tokens} context tokens).")
+            return full_system_prompt, user_query
 
         except Exception as e:
             log_event("ERROR", f"Error while building prompt: {e}")
@@ -75,34 +231,25 @@ class TokenHandler:
 
         if not chat_history:
             return ""
-        
-        total_tokens = 0
 
-        for message in chat_history:
+        # Walk from the newest message back, encoding each once, and keep the longest
+        # recent run that fits.
+        total_tokens = 0
+        keep_from = len(chat_history)
 
+        for i in range(len(chat_history) - 1, -1, -1):
+            message = chat_history[i]
             role = message.get("role", "")
             content = message.get("content", "")
 
-            message_text = f"{role}: {content}"
-            total_tokens += self.count_tokens(message_text)
+            message_tokens = self.count_tokens(f"{role}: {content}")
+            if total_tokens + message_tokens > max_tokens:
+                break
 
+            total_tokens += message_tokens
+            keep_from = i
 
-        if total_tokens <= max_tokens:
+        if keep_from == 0:
             return chat_history
 
-        trimmed_history = chat_history.copy()            
-        current_tokens = total_tokens
-
-        while current_tokens > max_tokens and trimmed_history:
-
-            removed_message = trimmed_history.pop(0)
-
-            role = removed_message.get("role", "")
-            content = removed_message.get("content", "")
-
-            removed_message_tokens = self.count_tokens(f"{role}: {content}")
-
-            current_tokens -= removed_message_tokens
-
-        return trimmed_history
-
+        return chat_history[keep_from:]